@@ -1,7 +1,10 @@
 import math
 import numpy as np
 
+# Positions are court coordinates in mm (z is the height above the floor), see Server/Vision/CourtPlane.py
 class Position:
+    __slots__ = ("x", "y", "z")
+
     def __init__(self, x, y, z):
         self.x = x
         self.y = y
@@ -24,16 +27,100 @@ class Position:
         return [float(self.x), float(self.y), float(self.z)]
 
     def is_close(self, other):
-        diff = self - other
-        return math.sqrt(diff.x**2 + diff.y**2 + diff.z**2) < 20 # TODO: threshold
+        return math.sqrt((self.x - other.x)**2 + (self.y - other.y)**2 + (self.z - other.z)**2) < 20 # mm TODO: threshold
 
     def flat_distance(self, other):
-        diff = self - other
-        return math.sqrt(diff.x**2 + diff.y**2 )
+        return math.hypot(self.x - other.x, self.y - other.y)
 
     def get_other_position(self, angle, distance):
         return Position(self.x + math.cos(angle) * distance, self.y + math.sin(angle) * distance, self.z)
 
+# Wraps angles (radians, scalar or array) to [-pi, pi)
+def wrap_to_pi(angles):
+    return np.mod(np.asarray(angles) + math.pi, 2 * math.pi) - math.pi
+
+class PositionArray:
+    """
+    N positions stored as one (N, 3) array (struct of arrays in the columns x, y, z).
+    The batch functions compare all positions with one position (e.g. the robot) in a few NumPy calls.
+    Indexing returns a PositionView, a Position that reads and writes its row of the array.
+    """
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = np.asarray(data, dtype=np.float64).reshape(-1, 3)
+
+    @staticmethod
+    def from_positions(positions):
+        return PositionArray([(position.x, position.y, position.z) for position in positions])
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, i):
+        return PositionView(self, i)
+
+    def __iter__(self):
+        return (PositionView(self, i) for i in range(len(self.data)))
+
+    @property
+    def x(self):
+        return self.data[:, 0]
+
+    @property
+    def y(self):
+        return self.data[:, 1]
+
+    @property
+    def z(self):
+        return self.data[:, 2]
+
+    # Distance in the x-y plane of every position to other
+    def flat_distances(self, other):
+        return np.hypot(self.x - other.x, self.y - other.y)
+
+    # Direction (radians) from other to every position
+    def bearings(self, other):
+        return np.arctan2(self.y - other.y, self.x - other.x)
+
+    # The angle the robot has to turn to face every position (see RobotLocation.angle_to)
+    def turn_angles(self, robot):
+        return wrap_to_pi(self.bearings(robot) - robot.angle)
+
+    def within_circle(self, center, radius):
+        return (self.x - center.x) ** 2 + (self.y - center.y) ** 2 <= radius ** 2
+
+class PositionView(Position):
+    __slots__ = ("array", "index")
+
+    def __init__(self, array, index):
+        self.array = array
+        self.index = index
+
+    @property
+    def x(self):
+        return self.array.data[self.index, 0]
+
+    @x.setter
+    def x(self, value):
+        self.array.data[self.index, 0] = value
+
+    @property
+    def y(self):
+        return self.array.data[self.index, 1]
+
+    @y.setter
+    def y(self, value):
+        self.array.data[self.index, 1] = value
+
+    @property
+    def z(self):
+        return self.array.data[self.index, 2]
+
+    @z.setter
+    def z(self, value):
+        self.array.data[self.index, 2] = value
+
 class Orientation:
     # angle in radians
     def __init__(self, angle):
@@ -50,9 +137,13 @@ class BirdieLocation(Position, Orientation):
 
 
 class RobotLocation(Position, Orientation):
-    _grabber_length = 30 # TODO
-    center_to_grabber_tip = 160 # TODO
+    _grabber_length = 30 # mm TODO
+    center_to_grabber_tip = 160 # mm TODO
     grabber_angle = math.radians(40) # TODO
+    _axle_track = 119 # mm, as configured for the DriveBase in Robot/main.py
+    _rear_length = 100 # mm from the center (the middle of the axle) to the back of the brick
+    # mm from the center to the side of the robot: the open grabber arm tips reach further out than the wheels
+    _half_width = math.ceil(max(center_to_grabber_tip * math.sin(grabber_angle), _axle_track / 2))
 
     def __init__(self, x, y, z, angle):
         Position.__init__(self, x, y, z)
@@ -71,10 +162,18 @@ class RobotLocation(Position, Orientation):
             self.z
             )
 
+    # returns the (4, 2) corners of the robot outline (including the grabber) grown by margin
+    def footprint(self, margin=0):
+        front = self.center_to_grabber_tip + margin
+        rear = -(self._rear_length + margin)
+        side = self._half_width + margin
+        outline = np.array([(front, side), (front, -side), (rear, -side), (rear, side)], dtype=np.float64)
+        cos_angle, sin_angle = math.cos(self.angle), math.sin(self.angle)
+        return outline @ np.array([[cos_angle, sin_angle], [-sin_angle, cos_angle]]) + (self.x, self.y)
+
     # returns the angle the robot has to turn to face other
     def angle_to(self, other):
-        bearingVector = other - self
-        bearingAngle = math.atan2(bearingVector.y, bearingVector.x)
+        bearingAngle = math.atan2(other.y - self.y, other.x - self.x)
 
         deltaAngle = bearingAngle - self.angle
 
@@ -91,7 +190,7 @@ class CourtLocation():
     LENGTH = 13.4 / 2  # in meters
     MIDDLE_TO_SERVEZONE = 1.98 # in meters
 
-    SCALE = 130
+    SCALE = 130 # pixels per court meter in the camera image
 
     def set_corners(self, aruco_corners=None, court_corners=None):
         if aruco_corners is not None:
@@ -1,6 +1,5 @@
 import Server.Location as Location
 import math
-from operator import itemgetter
 from collections import deque
 import numpy as np
 
@@ -26,49 +25,45 @@ def next_collection_target(robot_location: Location.RobotLocation, birdie_positi
     # birdie could be between wheel and grabber
     # don't run over birdie with wheel
     # avoid pushing birdie away with grabber
-    # All birdies that will be hit by the grabber if the robot turns
-    too_close = [
-        (birdie, robot_location.angle_to(birdie))
-        for birdie in filter(
-            lambda birdie: within_circle(birdie, robot_location, robot_location.center_to_grabber_tip),
-            birdie_positions
-            )
-        ]
+    # Distances and turning angles to all birdies at once
+    birdies = Location.PositionArray.from_positions(birdie_positions)
+    distances = birdies.flat_distances(robot_location)
+    angles = birdies.turn_angles(robot_location)
+    left_turning_angles = np.mod(angles, 2 * math.pi)
+    right_turning_angles = np.mod(angles, -2 * math.pi)
 
-    # the birdie that would be first hit by the grippers if the robot turns left
-    (left_closest, left_closest_angle) = min(too_close, key=lambda pair: modN(pair[1], 2 * math.pi), default=(None, None))
-    # the birdie that would be first hit by the grippers if the robot turns right
-    (right_closest, right_closest_angle) = max(too_close, key=lambda pair: modN(pair[1], -2 * math.pi), default=(None, None))
+    # All birdies that will be hit by the grabber if the robot turns
+    too_close = birdies.within_circle(robot_location, robot_location.center_to_grabber_tip)
 
     next_birdie = None
     next_turning_angle = None
     next_dist = None
 
-    if left_closest == None and right_closest == None:
+    if not too_close.any():
         # will not hit any birdie while turning so we can just pick closest one
-        birdies_dist_angle = [(birdie, robot_location.flat_distance(birdie), abs(robot_location.angle_to(birdie))) for birdie in birdie_positions]
-        next_birdie, _, _ = min(birdies_dist_angle, key=itemgetter(1,2))
-        next_turning_angle = robot_location.angle_to(next_birdie)
-    elif len(too_close) < len(birdie_positions):
-        for birdie in birdie_positions:
-            angle_relative_to_robot = robot_location.angle_to(birdie)
-            dist = robot_location.flat_distance(birdie)
-            left_turning_angle = modN(angle_relative_to_robot, 2 * math.pi)
-            right_turning_angle = modN(angle_relative_to_robot, -2* math.pi)
+        index = np.lexsort((np.abs(angles), distances))[0]
+        next_birdie = birdie_positions[index]
+        next_turning_angle = float(angles[index])
+    elif not too_close.all():
+        # the birdie that would be first hit by the grippers if the robot turns left
+        left_closest_angle = left_turning_angles[too_close].min()
+        # the birdie that would be first hit by the grippers if the robot turns right
+        right_closest_angle = right_turning_angles[too_close].max()
+
+        # check for every birdie if turning the robot (left, right or both) to the desired angle is possible without hitting other birdies
+        left_possible = turning_left_possible(left_turning_angles, left_closest_angle)
+        right_possible = turning_right_possible(right_turning_angles, right_closest_angle)
+        shorter_turn = np.where(np.abs(left_turning_angles) <= np.abs(right_turning_angles), left_turning_angles, right_turning_angles)
+        turning_angles = np.where(left_possible & right_possible, shorter_turn,
+                                  np.where(left_possible, left_turning_angles, right_turning_angles))
+        possible = (left_possible | right_possible).tolist()
+
+        for index, (dist, angle) in enumerate(zip(distances.tolist(), turning_angles.tolist())):
             if next_birdie is None or dist <= next_dist:
-                # check if turning the robot to the desired angle is possible without hitting other birdies
-                if turning_left_possible(left_turning_angle, left_closest_angle) and turning_right_possible(right_turning_angle, right_closest_angle):
-                    angle = min(left_turning_angle, right_turning_angle, key=abs)
-                # check if turning the robot left to the desired angle is possible without hitting other birdies
-                elif turning_left_possible(left_turning_angle, left_closest_angle):
-                    angle = left_turning_angle
-                # check if turning the robot right to the desired angle is possible without hitting other birdies
-                elif turning_right_possible(right_turning_angle, right_closest_angle):
-                    angle = right_turning_angle
-                else:
+                if not possible[index]:
                     continue
                 if next_birdie is None or abs(angle) < abs(next_turning_angle):
-                    next_birdie = birdie
+                    next_birdie = birdie_positions[index]
                     next_turning_angle = angle
                     next_dist = dist
 
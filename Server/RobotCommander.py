@@ -3,6 +3,10 @@ from enum import StrEnum
 import math
 from Server.Location import Position
 
+# Speeds the robot program (Robot/main.py) drives with
+DRIVE_SPEED = 80 # mm/s
+TURN_RATE = math.radians(20) # rad/s
+
 class Direction(StrEnum):
     RIGHT = "RIGHT"
     LEFT = "LEFT"
@@ -15,6 +19,10 @@ class Turn:
     def __str__(self):
         return f"{self.direction} {math.degrees(self.radians)}"
 
+    # (speed in mm/s, turn rate in rad/s) the robot moves with after this command
+    def motion(self):
+        return (0, -TURN_RATE if self.direction == Direction.LEFT else TURN_RATE)
+
 class Forward:
     def __init__(self, radians = 0):
         self.radians = radians
@@ -22,6 +30,10 @@ class Forward:
     def __str__(self):
         return f"FORWARD {math.degrees(self.radians)}"
 
+    def motion(self):
+        # The robot uses the angle as turn rate in deg/s
+        return (DRIVE_SPEED, self.radians)
+
 class WheelTurn:
     def __init__(self, turns):
         self.turns = turns
@@ -29,14 +41,24 @@ class WheelTurn:
     def __str__(self):
         return f"WHEEL {self.turns}"
 
+    def motion(self):
+        # Drives a fixed distance with an unknown speed
+        return None
+
 class Stop:
     def __str__(self):
         return "STOP"
 
+    def motion(self):
+        return (0, 0)
+
 class End:
     def __str__(self):
         return "END"
 
+    def motion(self):
+        return (0, 0)
+
 class Move:
     def __init__(self, position: Position):
         self.position = position
@@ -61,6 +83,7 @@ class RobotCommander:
         self.client = BluetoothMailboxClient()
         self.commandBox = TextMailbox('command', self.client)
         self.hitBox = TextMailbox('hit', self.client)
+        self.listeners = [] # functions that get every sent command (e.g. the robot pose filter)
 
         print("Connecting to EV3...")
         try:
@@ -74,3 +97,8 @@ class RobotCommander:
         # for cmd in commands:
         self.commandBox.send(cmd.__str__())
         print(f"Sending: {cmd}")
+        for listener in self.listeners:
+            listener(cmd)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
@@ -0,0 +1,310 @@
+import math
+import time
+import numpy as np
+
+import Server.Location as Location
+import Server.Path as Path
+from Server.RobotCommander import DRIVE_SPEED, TURN_RATE
+
+"""
+Collection route optimizer.
+
+The order in which the birdies are collected is an asymmetric travelling salesman problem:
+the cost of driving to a birdie is the time to turn towards it plus the time to drive there, and
+the turn depends on where the robot came from. A turn that would sweep the grabber over a birdie
+that is still on the floor (see Path.turning_left_possible / turning_right_possible) has to go the
+other way round, or is penalized if both directions are blocked.
+
+Up to EXACT_LIMIT birdies the order is solved exactly by dynamic programming over
+(collected set, last birdie, birdie before). Larger sets start from the greedy order and are
+improved by 2-opt and Or-opt moves until no move helps or the time budget is used up.
+"""
+class RoutePlanner:
+    EXACT_LIMIT = 7
+    BLOCKED_PENALTY = 60 # seconds added for a turn that pushes a birdie with the grabber in both directions
+    MAX_SEGMENT = 3 # longest segment Or-opt moves
+
+    def __init__(self, time_budget=0.5):
+        self.time_budget = time_budget # seconds the local search may use
+
+    # This function returns the indices of birdie_positions in the order they should be collected.
+    # time_budget and exact_limit override the defaults (e.g. for a quick repair of a route)
+    def plan(self, robot_location: Location.RobotLocation, birdie_positions: list, time_budget=None, exact_limit=None):
+        if len(birdie_positions) == 0:
+            return []
+        time_budget = self.time_budget if time_budget is None else time_budget
+        exact_limit = self.EXACT_LIMIT if exact_limit is None else exact_limit
+        costs = RouteCost(robot_location, birdie_positions)
+        if len(birdie_positions) <= exact_limit:
+            return self.solve_exact(costs)
+        order = self.solve_greedy(costs)
+        return self.improve(costs, order, time.time() + time_budget)
+
+    def solve_exact(self, costs):
+        n = costs.n
+        start = costs.start
+        # layers[mask]: (last, prev) -> (cost, parent key)
+        layers = [dict() for _ in range(1 << n)]
+        for j in range(n):
+            layers[1 << j][(j, start)] = (costs.step(start, costs.robot_angle, j, 0), None)
+
+        # Every transition adds a bit, so increasing masks are processed after all their predecessors
+        for mask in range(1, 1 << n):
+            for (last, prev), (cost, _) in layers[mask].items():
+                heading = costs.bearings[prev, last]
+                for j in range(n):
+                    if mask & (1 << j):
+                        continue
+                    key = (j, last)
+                    total = cost + costs.step(last, heading, j, mask)
+                    next_layer = layers[mask | (1 << j)]
+                    if key not in next_layer or total < next_layer[key][0]:
+                        next_layer[key] = (total, (mask, last, prev))
+
+        full = (1 << n) - 1
+        (last, prev), _ = min(layers[full].items(), key=lambda item: item[1][0])
+        order = []
+        state = (full, last, prev)
+        while state is not None:
+            mask, last, prev = state
+            order.append(last)
+            state = layers[mask][(last, prev)][1]
+        return order[::-1]
+
+    def solve_greedy(self, costs):
+        order = []
+        collected = 0
+        position, heading = costs.start, costs.robot_angle
+        for _ in range(costs.n):
+            j = min((j for j in range(costs.n) if not collected & (1 << j)),
+                    key=lambda j: costs.step(position, heading, j, collected))
+            order.append(j)
+            collected |= 1 << j
+            position, heading = j, costs.bearings[position, j]
+        return order
+
+    # This function applies improving 2-opt (reverse a segment) and Or-opt (move a segment) moves until
+    # none is left or the deadline passed
+    def improve(self, costs, order, deadline):
+        best = costs.route(order)
+        improved = True
+        while improved and time.time() < deadline:
+            improved = False
+            for candidate in self.neighbours(order):
+                cost = costs.route(candidate)
+                if cost < best - 1e-9:
+                    order, best, improved = candidate, cost, True
+                    break
+                if time.time() >= deadline:
+                    break
+        return order
+
+    def neighbours(self, order):
+        n = len(order)
+        for i in range(n - 1):
+            for k in range(i + 1, n):
+                yield order[:i] + order[i:k + 1][::-1] + order[k + 1:]
+        for length in range(1, self.MAX_SEGMENT + 1):
+            for i in range(n - length + 1):
+                segment = order[i:i + length]
+                rest = order[:i] + order[i + length:]
+                for k in range(len(rest) + 1):
+                    if k != i:
+                        yield rest[:k] + segment + rest[k:]
+
+
+"""
+A planned collection route that is repaired while the robot collects.
+
+Every frame the detected birdies are matched to the planned ones. As long as nothing changed the
+route stays as it is. A planned birdie is gone once it was not detected in MISS_LIMIT consecutive
+frames (a single frame of detection noise does not change the route). If a birdie is gone, was nudged or a new one shows up, only the part of the route
+from the first affected birdie on is planned again (starting at the pose the robot will have there),
+with a small time budget, so the route is current without a full replan per frame.
+"""
+class Route:
+    MATCH_DISTANCE = 100 # mm a planned birdie may move between two frames and still be matched
+    MOVE_TOLERANCE = 20 # mm a planned birdie may move before its leg is planned again
+    REPAIR_EXACT_LIMIT = 5 # the repair solves at most this many birdies exactly
+    MISS_LIMIT = 3 # consecutive frames a planned birdie is not detected until it counts as gone
+
+    def __init__(self, planner: RoutePlanner, robot_location: Location.RobotLocation, birdie_positions: list, vision_border,
+                 repair_budget=0.02):
+        self.planner = planner
+        self.vision_border = vision_border
+        self.repair_budget = repair_budget # seconds a repair may use for the local search
+        self.current = None # leg the robot is driving, see legs_from_order
+        self.misses = {} # id of a planned birdie position -> consecutive frames it was not detected
+        order = planner.plan(robot_location, birdie_positions)
+        self.legs = legs_from_order(robot_location, birdie_positions, order, vision_border) # legs that are not driven yet
+
+    def __len__(self):
+        return len(self.legs)
+
+    # This function starts the next leg and returns its (approach position, turning angle)
+    def next_target(self):
+        self.current = self.legs.pop(0)
+        _, next_pos, turning_angle, _ = self.current
+        return next_pos, turning_angle
+
+    # This function updates the route with the birdies detected in the newest frame.
+    # occluded(position) tells if a planned birdie is hidden from the camera (e.g. by the robot), such a birdie is kept
+    # when it is not detected.
+    # Returns True if the leg the robot is driving is stale (its birdie moved or is gone) and was replaced.
+    def repair(self, robot_location: Location.RobotLocation, detected_positions: list, occluded=None):
+        # A birdie between the grabber arms is being collected
+        detected = [position for position in detected_positions if not in_grabber(robot_location, position)]
+        planned = ([self.current] if self.current is not None else []) + self.legs
+        matches = self.match([leg[0] for leg in planned], detected)
+
+        # A planned birdie that is not detected is kept while the robot collects or hides it, or until it was missed
+        # MISS_LIMIT times in a row
+        misses = {}
+        kept = []
+        for i, leg in enumerate(planned):
+            key = id(leg[0])
+            misses[key] = self.misses.get(key, 0)
+            if i in matches:
+                misses[key] = 0
+            elif not (leg is self.current and in_grabber(robot_location, leg[0])) and not (occluded is not None and occluded(leg[0])):
+                misses[key] += 1
+            kept.append(i not in matches and misses[key] < self.MISS_LIMIT)
+        self.misses = misses
+
+        # The first planned birdie that is gone or moved, everything from there on is planned again
+        first = len(planned)
+        for i, leg in enumerate(planned):
+            match = matches.get(i)
+            if kept[i]:
+                continue # not seen (collected, hidden or detection noise), but not gone either
+            if match is None or leg[0].flat_distance(detected[match]) > self.MOVE_TOLERANCE:
+                first = i
+                break
+        new = [position for j, position in enumerate(detected) if j not in matches.values()]
+        if first == len(planned) and len(new) == 0:
+            return False
+
+        birdies = [detected[matches[i]] if i in matches else planned[i][0]
+                   for i in range(first, len(planned)) if i in matches or kept[i]] + new
+        stale = self.current is not None and first == 0
+        if stale:
+            self.current = None
+        offset = 1 if self.current is not None else 0
+
+        # Start where the robot is after the last unaffected leg
+        if first == 0:
+            start = robot_location
+        else:
+            _, next_pos, _, robot_angle = planned[first - 1]
+            start = Location.RobotLocation(next_pos.x, next_pos.y, next_pos.z, robot_angle)
+
+        order = self.planner.plan(start, birdies, self.repair_budget, self.REPAIR_EXACT_LIMIT)
+        self.legs = self.legs[:max(first - offset, 0)] + legs_from_order(start, birdies, order, self.vision_border)
+        return stale
+
+    # Greedy nearest neighbour matching of planned to detected birdies within MATCH_DISTANCE.
+    # Returns {planned index: detected index}
+    def match(self, planned, detected):
+        if len(planned) == 0 or len(detected) == 0:
+            return {}
+        planned_array = Location.PositionArray.from_positions(planned)
+        distances = np.stack([planned_array.flat_distances(position) for position in detected], axis=1)
+        planned_indices, detected_indices = np.nonzero(distances < self.MATCH_DISTANCE)
+        order = np.argsort(distances[planned_indices, detected_indices], kind="stable")
+
+        matches = {}
+        used = set()
+        for i, j in zip(planned_indices[order].tolist(), detected_indices[order].tolist()):
+            if i in matches or j in used:
+                continue
+            matches[i] = j
+            used.add(j)
+        return matches
+
+
+"""
+Travel time model of the route optimizer.
+Birdies are the nodes 0..n-1, the robot start is node n. Driving to a birdie is modelled as driving onto it,
+the heading at a birdie is the direction the robot came from.
+"""
+class RouteCost:
+
+    def __init__(self, robot_location, birdie_positions):
+        self.n = len(birdie_positions)
+        self.start = self.n
+        self.robot_angle = robot_location.angle
+        nodes = Location.PositionArray.from_positions(list(birdie_positions) + [robot_location])
+
+        dx = nodes.x[None, :] - nodes.x[:, None]
+        dy = nodes.y[None, :] - nodes.y[:, None]
+        self.distances = np.hypot(dx, dy) # [i, j] distance from node i to node j
+        self.bearings = np.arctan2(dy, dx) # [i, j] direction from node i to node j
+        radius = Location.RobotLocation.center_to_grabber_tip
+        # birdies the grabber reaches while the robot turns at node i
+        self.near = [np.nonzero(self.distances[i, :self.n] <= radius)[0].tolist() for i in range(self.n + 1)]
+
+    # Time to turn at node i (facing heading) towards birdie j and drive there, with the birdies in collected already picked up
+    def step(self, i, heading, j, collected):
+        turn_angle = Location.wrap_to_pi(self.bearings[i, j] - heading)
+        blockers = [Location.wrap_to_pi(self.bearings[i, k] - heading) for k in self.near[i]
+                    if k != j and not collected & (1 << k)]
+        turn_angle, blocked = choose_turn(turn_angle, blockers)
+        cost = abs(turn_angle) / TURN_RATE + self.distances[i, j] / DRIVE_SPEED
+        return cost + RoutePlanner.BLOCKED_PENALTY if blocked else cost
+
+    def route(self, order):
+        total = 0.0
+        collected = 0
+        position, heading = self.start, self.robot_angle
+        for j in order:
+            total += self.step(position, heading, j, collected)
+            collected |= 1 << j
+            position, heading = j, self.bearings[position, j]
+        return total
+
+
+# This function picks the direction of a turn by turn_angle (radians, wrapped to [-pi, pi)) that does not sweep the grabber
+# over a birdie at one of the blocker_angles (relative to the current heading).
+# Returns (turning angle, True if both directions are blocked)
+def choose_turn(turn_angle, blocker_angles):
+    left_turning_angle = Path.modN(turn_angle, 2 * math.pi)
+    right_turning_angle = Path.modN(turn_angle, -2 * math.pi)
+    shorter = min(left_turning_angle, right_turning_angle, key=abs)
+    if len(blocker_angles) == 0:
+        return shorter, False
+
+    left_closest_angle = min(Path.modN(angle, 2 * math.pi) for angle in blocker_angles)
+    right_closest_angle = max(Path.modN(angle, -2 * math.pi) for angle in blocker_angles)
+    left_possible = Path.turning_left_possible(left_turning_angle, left_closest_angle)
+    right_possible = Path.turning_right_possible(right_turning_angle, right_closest_angle)
+    if left_possible and right_possible:
+        return shorter, False
+    if left_possible:
+        return left_turning_angle, False
+    if right_possible:
+        return right_turning_angle, False
+    return shorter, True
+
+# This function simulates the robot along a collection order.
+# Returns a list of (birdie, approach position, turning angle, robot angle at the approach position)
+def legs_from_order(robot_location: Location.RobotLocation, birdie_positions: list, order, vision_border):
+    legs = []
+    current_robot = robot_location
+    for index, j in enumerate(order):
+        birdie = birdie_positions[j]
+        remaining = [birdie_positions[k] for k in order[index + 1:]
+                     if Path.within_circle(birdie_positions[k], current_robot, current_robot.center_to_grabber_tip)]
+        turning_angle, _ = choose_turn(current_robot.angle_to(birdie), [current_robot.angle_to(other) for other in remaining])
+
+        robot_next_angle = Location.wrap_to_pi(current_robot.angle + turning_angle)
+        next_pos = birdie.get_other_position(robot_next_angle, -current_robot.center_to_grabber_tip * 0.5)
+        next_pos = Path.check_border(next_pos, vision_border)
+        legs.append((birdie, next_pos, turning_angle, robot_next_angle))
+        current_robot = Location.RobotLocation(next_pos.x, next_pos.y, next_pos.z, robot_next_angle)
+    return legs
+
+# This function checks if a position is between the grabber arms of the robot (a birdie there is being collected)
+def in_grabber(robot_location: Location.RobotLocation, position):
+    return (robot_location.flat_distance(position) <= robot_location.center_to_grabber_tip
+            and abs(robot_location.angle_to(position)) <= robot_location.grabber_angle)
+
@@ -0,0 +1,24 @@
+import numpy as np
+import cv2
+
+"""
+ArUco marker search shared by the RealsenseServer and the vision pool workers.
+"""
+
+def make_aruco_detector():
+    arucoDict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_6X6_250)
+    arucoParams = cv2.aruco.DetectorParameters()
+    return cv2.aruco.ArucoDetector(arucoDict, arucoParams)
+
+# This function detects the aruco markers of a color image, restricted to the (x0, y0, x1, y1) window if it is not None.
+# Returns (corners, ids) in camera image pixel coordinates
+def detect_markers(detector, color_image, window=None):
+    if window is None:
+        aruco_corners, aruco_ids, rejected = detector.detectMarkers(color_image)
+        return aruco_corners, aruco_ids
+
+    x0, y0, x1, y1 = window
+    aruco_corners, aruco_ids, rejected = detector.detectMarkers(color_image[y0:y1, x0:x1])
+    offset = np.array([x0, y0], dtype=np.float32)
+    aruco_corners = tuple(cornerSet + offset for cornerSet in aruco_corners)
+    return aruco_corners, aruco_ids
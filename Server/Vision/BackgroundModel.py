@@ -0,0 +1,100 @@
+import numpy as np
+import cv2
+
+"""
+Adaptive background model for the birdie detection.
+
+The model keeps a running mean and variance per pixel of a downscaled gray image. A pixel is
+foreground if it differs from the mean by more than noise_factor standard deviations, but at least
+min_threshold (the tuned static threshold), so flickering areas get a higher threshold on their own.
+The mean and variance are updated with a small learning rate on the pixels that are background only:
+foreground pixels and the tracked objects (birdies, the robot) are excluded, so they are never
+learned into the background while lighting drift over a session is.
+
+All per frame work (difference, threshold, update) happens on the downscaled image, and the
+foreground mask is returned at that resolution. foreground_patch repeats the test at full
+resolution for small areas only, where the blob search needs exact contours (see BlobDetector).
+"""
+class BackgroundModel:
+
+    def __init__(self, gray_image, min_threshold, downscale=2, learning_rate=0.005, noise_factor=4.0, initial_noise=5.0):
+        self.min_threshold = min_threshold
+        self.downscale = downscale
+        self.learning_rate = learning_rate
+        self.noise_factor = noise_factor
+        self.initial_noise = initial_noise
+        self.learn_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+        self.reset(gray_image)
+
+    def reset(self, gray_image):
+        self.shape = gray_image.shape[:2] # (height, width) of the full resolution image
+        self.mean = self.shrink(gray_image).astype(np.float32)
+        self.variance = np.full_like(self.mean, self.initial_noise ** 2)
+        self.refresh()
+        self.last_small = None # downscaled frame of the last foreground call, learned by update
+        self.last_diff = None
+        self.last_mask = None
+
+    def shrink(self, gray_image):
+        height, width = gray_image.shape[:2]
+        size = (max(width // self.downscale, 1), max(height // self.downscale, 1))
+        return cv2.resize(gray_image, size, interpolation=cv2.INTER_AREA)
+
+    # The 8 bit mean and threshold images the foreground test works on
+    def refresh(self):
+        self.mean_image = cv2.convertScaleAbs(self.mean)
+        # convertScaleAbs scales the standard deviation and saturates it to 8 bit in one pass
+        self.threshold = cv2.max(cv2.convertScaleAbs(cv2.sqrt(self.variance), alpha=self.noise_factor), self.min_threshold)
+
+    # This function returns the foreground mask (0 / 255) of a gray image of the modelled area, downscaled by downscale
+    def foreground(self, gray_image):
+        if gray_image.shape[:2] != self.shape:
+            raise ValueError(f"Image of shape {gray_image.shape[:2]} does not match the background model {self.shape}")
+        small = self.shrink(gray_image)
+        diff = cv2.absdiff(small, self.mean_image)
+        mask = cv2.compare(diff, self.threshold, cv2.CMP_GT)
+        self.last_small, self.last_diff, self.last_mask = small, diff, mask
+        return mask
+
+    # This function returns the full resolution foreground mask of the (x, y, w, h) rect of a gray image of the modelled area.
+    # The mean and threshold are upsampled for the rect only. The rect is clipped to the modelled area, the returned mask
+    # has the clipped size.
+    def foreground_patch(self, gray_image, rect):
+        x, y, w, h = rect
+        d = self.downscale
+        small_height, small_width = self.mean_image.shape
+        w = min(w, small_width * d - x)
+        h = min(h, small_height * d - y)
+        cell_x0, cell_y0 = x // d, y // d
+        cell_x1, cell_y1 = -(-(x + w) // d), -(-(y + h) // d)
+        size = ((cell_x1 - cell_x0) * d, (cell_y1 - cell_y0) * d)
+        crop = (slice(y - cell_y0 * d, y - cell_y0 * d + h), slice(x - cell_x0 * d, x - cell_x0 * d + w))
+
+        mean = cv2.resize(self.mean_image[cell_y0:cell_y1, cell_x0:cell_x1], size, interpolation=cv2.INTER_LINEAR)[crop]
+        threshold = cv2.resize(self.threshold[cell_y0:cell_y1, cell_x0:cell_x1], size, interpolation=cv2.INTER_NEAREST)[crop]
+        diff = cv2.absdiff(gray_image[y:y + h, x:x + w], mean)
+        return cv2.compare(diff, threshold, cv2.CMP_GT)
+
+    # This function learns the frame of the last foreground call.
+    # exclude_rects (x, y, w, h) and exclude_polygons (pixel point arrays) are full resolution areas covered by tracked objects.
+    def update(self, exclude_rects=(), exclude_polygons=()):
+        if self.last_small is None:
+            return
+        blocked = cv2.dilate(self.last_mask, self.learn_kernel)
+        for x, y, w, h in exclude_rects:
+            cv2.rectangle(blocked, (x // self.downscale, y // self.downscale),
+                          ((x + w) // self.downscale, (y + h) // self.downscale), 255, -1)
+        for polygon in exclude_polygons:
+            cv2.fillConvexPoly(blocked, (np.asarray(polygon) // self.downscale).astype(np.int32), 255)
+        learn = cv2.bitwise_not(blocked)
+
+        squared_diff = cv2.multiply(self.last_diff, self.last_diff, dtype=cv2.CV_32F)
+        cv2.accumulateWeighted(squared_diff, self.variance, self.learning_rate, mask=learn)
+        cv2.accumulateWeighted(self.last_small, self.mean, self.learning_rate, mask=learn)
+        self.refresh()
+        self.last_small = None
+
+    # This function returns the current background as a full resolution gray image
+    def image(self):
+        mean = np.clip(self.mean, 0, 255).astype(np.uint8)
+        return cv2.resize(mean, (self.shape[1], self.shape[0]), interpolation=cv2.INTER_LINEAR)
@@ -1,23 +1,95 @@
+import time
 import cv2
+import numpy as np
 from Server.Location import BirdieLocation, Position
+from Server.Vision.LandingPredictor import LandingPredictor
+
+"""
+Fixed capacity ring buffer of timestamped birdie positions.
+Each row is (t, x, y, z). Appending is O(1), memory does not grow over a long rally.
+"""
+class History:
+    T, X, Y, Z = range(4)
+
+    def __init__(self, capacity=128):
+        self.capacity = capacity
+        self.data = np.zeros((capacity, 4), dtype=np.float64)
+        self.count = 0 # number of positions appended so far
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, t, x, y, z):
+        self.data[self.count % self.capacity] = (t, x, y, z)
+        self.count += 1
+
+    # This function returns the newest n rows (all stored rows if n is None), oldest first
+    def last(self, n=None):
+        n = len(self) if n is None else min(n, len(self))
+        indices = np.arange(self.count - n, self.count) % self.capacity
+        return self.data[indices]
+
+    # Returns the (x, y, z) position at index i (negative indices count from the newest position)
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("History index out of range")
+        row = self.data[(self.count - len(self) + i) % self.capacity]
+        return (row[History.X], row[History.Y], row[History.Z])
+
+    # This function estimates the (vx, vy, vz) velocity per second over the newest window positions
+    # as the least squares slope of position over time
+    def velocity(self, window=10):
+        rows = self.last(window)
+        if len(rows) < 2:
+            return np.zeros(3)
+        t = rows[:, History.T] - rows[:, History.T].mean()
+        denominator = np.dot(t, t)
+        if denominator == 0:
+            return np.zeros(3)
+        positions = rows[:, History.X:] - rows[:, History.X:].mean(axis=0)
+        return t @ positions / denominator
+
+    # This function returns the moving direction on the court (radians) over the newest window positions
+    def direction(self, window=10):
+        vx, vy, _ = self.velocity(window)
+        return np.arctan2(vy, vx)
+
 
 class Birdie(BirdieLocation):
-    def __init__(self, x, y, z, hit_ground, bounding_rect, contour):
+    HISTORY_SIZE = 128 # positions kept per birdie
+    TRAJECTORY_WINDOW = 10 # positions used for velocity / direction estimates
+    PREDICTION_TOLERANCE = 50 # height residual (mm) of the trajectory fit at which the prediction confidence is halved
+
+    def __init__(self, x, y, z, hit_ground, bounding_rect, contour, id=None, timestamp=None):
+        self.id = id
         self.bounding_rect = bounding_rect  # (x, y, w, h)
         self.contour = contour
         super().__init__(x, y, z, self.calculate_orientation(), hit_ground)
-        self.history = [(x, y, z)]  # Initialize with the current position
+        timestamp = time.time() if timestamp is None else timestamp
+        self.history = History(self.HISTORY_SIZE)
+        self.history.append(timestamp, x, y, z)  # Initialize with the current position
+        self.predictor = LandingPredictor(self.PREDICTION_TOLERANCE)
+        self.predictor.update(timestamp, x, y, z)
         self.trajectory = None # Can be 'left2left', 'left2right', 'right2right', 'right2left'
 
         self.impact_position = None
+        self.predicted_impact = None # Position where the trajectory fit hits the ground
+        self.predicted_impact_time = None
+        self.prediction_confidence = 0.0
         self.is_static = False
+        self.camera_point = None # deprojected (x, y, z) in meters in camera space (x, y, z of the birdie are court coordinates)
+        self.missed_frames = 0 # frames since the tracker last saw this birdie
+        self.landing_reported = False
 
-    def update(self, x, y, z, bounding_rect, contour, court_z):
+    def update(self, x, y, z, bounding_rect, contour, ground_height, timestamp=None):
         if not self.is_static:
             last_x, last_y, last_z = self.history[-1]
-            self.is_static = ((x - last_x)**2 + (y - last_y)**2) ** 0.5 < 2 and (z - last_z) < 0.01
+            self.is_static = ((x - last_x)**2 + (y - last_y)**2) ** 0.5 < 2 and (last_z - z) < 10
 
-        self.history.append((x, y, z))  # Append the new position to history
+        timestamp = time.time() if timestamp is None else timestamp
+        self.history.append(timestamp, x, y, z)  # Append the new position to history
         self.x = x
         self.y = y
         self.z = z
@@ -29,11 +101,17 @@ class Birdie(BirdieLocation):
             # Do not update the position if the birdie has hit the ground
             return
 
-        # TODO implement check that sets hit_ground to true if z = floor
-        if self.z >= court_z*0.9 : # Take the z value from aruco marker court
+        if self.z <= ground_height: # z is the height above the court floor
             print("Birdie hit ground.")
             self.hit_ground = True
             self.impact_position = Position(x, y, z)
+            return
+
+        # Predict the impact while the birdie is still in the air
+        self.predictor.update(timestamp, x, y, z)
+        prediction = self.predictor.predict(timestamp, ground_height)
+        if prediction is not None:
+            self.predicted_impact, self.predicted_impact_time, self.prediction_confidence = prediction
 
     def calculate_orientation(self):
         # Calculate the orientation using the contour
@@ -47,11 +125,14 @@ class Birdie(BirdieLocation):
             print("ERROR: Not enough history points to calculate trajectory")
             return None
 
-        # Calculate the average moving x direction
-        delta_x = 0
-        for i in range(len(self.history)-1):
-            x1 = self.history[i][1] # older datapoint
-            x2 = self.history[i+1][1] # newer datapoint
-            delta_x += x2 - x1
+        # The average moving x direction is the x distance covered over the trajectory window
+        rows = self.history.last(self.TRAJECTORY_WINDOW)
+        delta_x = rows[-1, History.X] - rows[0, History.X]
+
+        return delta_x
+
+    def velocity(self):
+        return self.history.velocity(self.TRAJECTORY_WINDOW)
 
-        return delta_x
\ No newline at end of file
+    def direction(self):
+        return self.history.direction(self.TRAJECTORY_WINDOW)
@@ -0,0 +1,100 @@
+import time
+import numpy as np
+
+from Server.Vision.Birdie import Birdie
+
+"""
+This class tracks all hit birdies in view at the same time.
+
+Every frame the detections are assigned to the existing tracks by global nearest neighbour:
+all track/detection pairs closer than gate_distance are sorted by distance and assigned greedily,
+which is O(n log n) in the number of candidate pairs. Unassigned detections start new tracks with
+a new id, tracks that were not seen for more than lifetime_threshold frames are dropped.
+
+If min_prediction_confidence is set, a birdie in flight is already reported as landed once its
+predicted impact is confident enough and less than prediction_horizon seconds away.
+"""
+class BirdieTracker:
+
+    def __init__(self, gate_distance, lifetime_threshold, min_prediction_confidence=None, prediction_horizon=0.3):
+        self.gate_distance = gate_distance
+        self.lifetime_threshold = lifetime_threshold
+        self.min_prediction_confidence = min_prediction_confidence
+        self.prediction_horizon = prediction_horizon
+        self.tracks = {} # id -> Birdie
+        self.next_id = 0
+
+    def reset(self):
+        self.tracks = {}
+
+    def birdies(self):
+        return list(self.tracks.values())
+
+    # detections: list of (court_point, bounding_rect, contour, camera_point)
+    def update(self, detections, ground_height, timestamp=None):
+        track_ids = list(self.tracks.keys())
+        assigned_tracks = set()
+        assigned_detections = set()
+
+        if len(track_ids) > 0 and len(detections) > 0:
+            track_positions = np.array([(self.tracks[track_id].x, self.tracks[track_id].y) for track_id in track_ids], dtype=np.float64)
+            detection_positions = np.array([(centerRS[0], centerRS[1]) for centerRS, _, _, _ in detections], dtype=np.float64)
+
+            # (tracks, detections) distance matrix, only pairs inside the gate are candidates
+            distances = np.linalg.norm(track_positions[:, None, :] - detection_positions[None, :, :], axis=2)
+            track_indices, detection_indices = np.nonzero(distances < self.gate_distance)
+            order = np.argsort(distances[track_indices, detection_indices], kind="stable")
+
+            for track_index, detection_index in zip(track_indices[order].tolist(), detection_indices[order].tolist()):
+                if track_index in assigned_tracks or detection_index in assigned_detections:
+                    continue
+                assigned_tracks.add(track_index)
+                assigned_detections.add(detection_index)
+
+                centerRS, bounding_rect, contour, camera_point = detections[detection_index]
+                birdie = self.tracks[track_ids[track_index]]
+                birdie.update(*centerRS, bounding_rect, contour, ground_height, timestamp)
+                birdie.camera_point = camera_point
+                birdie.missed_frames = 0
+
+        # Age the tracks that were not seen in this frame
+        for track_index, track_id in enumerate(track_ids):
+            if track_index in assigned_tracks:
+                continue
+            birdie = self.tracks[track_id]
+            birdie.missed_frames += 1
+            if birdie.missed_frames > self.lifetime_threshold:
+                del self.tracks[track_id]
+
+        # Start new tracks
+        for detection_index, (centerRS, bounding_rect, contour, camera_point) in enumerate(detections):
+            if detection_index in assigned_detections:
+                continue
+            print(f"Create a new Birdie (ID: {self.next_id})")
+            birdie = Birdie(*centerRS, False, bounding_rect, contour, id=self.next_id, timestamp=timestamp)
+            birdie.camera_point = camera_point
+            self.tracks[self.next_id] = birdie
+            self.next_id += 1
+
+    # This function returns the birdies that hit the ground (or are predicted to hit it shortly) since the last call.
+    # Every landing is reported once, impact_position holds the (predicted) impact.
+    def new_landings(self, now=None):
+        now = time.time() if now is None else now
+        landed = []
+        for birdie in self.tracks.values():
+            if birdie.landing_reported:
+                continue
+            if birdie.hit_ground:
+                birdie.landing_reported = True
+                landed.append(birdie)
+            elif self.predicts_landing(birdie, now):
+                birdie.impact_position = birdie.predicted_impact
+                birdie.landing_reported = True
+                landed.append(birdie)
+        return landed
+
+    def predicts_landing(self, birdie, now):
+        return (self.min_prediction_confidence is not None
+                and birdie.predicted_impact is not None
+                and birdie.prediction_confidence >= self.min_prediction_confidence
+                and birdie.predicted_impact_time - now <= self.prediction_horizon)
@@ -0,0 +1,117 @@
+import cv2
+import numpy as np
+
+from Server.Vision.Depth import sample_depths
+
+"""
+Coarse to fine blob detection on a BackgroundModel.
+
+The candidates are found on the downscaled foreground mask of the model (morphology with scaled
+kernels). Only around the candidates the foreground is computed again at full resolution, cleaned
+with the full size kernels and searched for the contours, so the same blobs are found as by a full
+resolution search while most of the image is only touched at low resolution. The mean and threshold
+of the model are upsampled for the patches, so on textured or lined backgrounds the contour areas
+can differ by a few percent from a full resolution model (the bounding rects match).
+All kernels are built once.
+"""
+class BlobDetector:
+    COARSE_MIN_AREA_FACTOR = 0.5 # candidates may be this much smaller than min_area in the coarse mask
+    COARSE_MAX_AREA_FACTOR = 2.0 # ... or this much larger than max_area
+
+    def __init__(self, min_area, max_area, downscale, open_size=5, close_size=10):
+        self.min_area = min_area
+        self.max_area = max_area
+        self.downscale = downscale
+        self.margin = open_size + close_size # pixels around a candidate that the full resolution morphology can reach
+
+        self.fine_open = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (open_size, open_size))
+        # This kernelsize was chosen to merge the head and the feathers of the birdie into one object
+        self.fine_close = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (close_size, close_size))
+        self.coarse_open = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, self.scaled_size(open_size))
+        self.coarse_close = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, self.scaled_size(close_size))
+
+    def scaled_size(self, size):
+        size = max(int(round(size / self.downscale)), 1)
+        return (size, size)
+
+    # This function detects the blobs of gray_image (an image of the area modelled by background).
+    # offset is added to the returned contours (position of the modelled area in the camera image),
+    # exclude_polygons are camera image pixel polygons that are never foreground (e.g. the robot).
+    # Returns (contours in camera image coordinates, coarse mask)
+    def detect(self, background, gray_image, offset=(0, 0), exclude_polygons=()):
+        offset = np.array(offset, dtype=np.int32)
+        polygons = [np.asarray(polygon, dtype=np.int32) - offset for polygon in exclude_polygons]
+
+        coarse_mask = background.foreground(gray_image)
+        for polygon in polygons:
+            cv2.fillConvexPoly(coarse_mask, polygon // self.downscale, 0)
+        coarse_mask = cv2.morphologyEx(coarse_mask, cv2.MORPH_OPEN, self.coarse_open)
+        coarse_mask = cv2.morphologyEx(coarse_mask, cv2.MORPH_CLOSE, self.coarse_close)
+
+        contours = []
+        for x, y, w, h in self.candidate_rects(coarse_mask, gray_image.shape):
+            mask = background.foreground_patch(gray_image, (x, y, w, h))
+            for polygon in polygons:
+                cv2.fillConvexPoly(mask, polygon - (x, y), 0)
+            mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.fine_open)
+            mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, self.fine_close)
+            patch_contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(int(x + offset[0]), int(y + offset[1])))
+            contours.extend(patch_contours)
+
+        return contours, coarse_mask
+
+    # This function returns the full resolution (x, y, w, h) patches around the coarse blobs of a plausible size.
+    # Overlapping patches are merged, so no blob is found twice.
+    def candidate_rects(self, coarse_mask, image_shape):
+        height, width = image_shape[:2]
+        area_scale = self.downscale * self.downscale
+        contours, _ = cv2.findContours(coarse_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        rects = []
+        for contour in contours:
+            area = cv2.contourArea(contour) * area_scale
+            if area < self.min_area * self.COARSE_MIN_AREA_FACTOR or area > self.max_area * self.COARSE_MAX_AREA_FACTOR:
+                continue
+            x, y, w, h = cv2.boundingRect(contour)
+            x0 = max(x * self.downscale - self.margin, 0)
+            y0 = max(y * self.downscale - self.margin, 0)
+            x1 = min((x + w) * self.downscale + self.margin, width)
+            y1 = min((y + h) * self.downscale + self.margin, height)
+            rects.append([x0, y0, x1, y1])
+
+        # Merge overlapping patches until none overlap
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(rects)):
+                for j in range(i + 1, len(rects)):
+                    a, b = rects[i], rects[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        rects[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        del rects[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+
+        return [(x0, y0, x1 - x0, y1 - y0) for x0, y0, x1, y1 in rects]
+
+    # This function filters the contours by area and samples a robust depth (in meters) at the center of every remaining blob.
+    # Returns (contours, bounding rects (N, 4), centers (N, 2), depths (N,))
+    def measure(self, contours, depth_image, depth_radius, depth_scale):
+        kept = []
+        for contour in contours:
+            contourArea = cv2.contourArea(contour)
+            if contourArea > self.min_area and contourArea < self.max_area:  # Filter small blobs
+                kept.append(contour)
+        if len(kept) == 0:
+            return [], np.zeros((0, 4), dtype=np.int64), np.zeros((0, 2), dtype=np.int64), np.zeros(0)
+
+        rects = np.array([cv2.boundingRect(contour) for contour in kept])
+        centers = rects[:, :2] + rects[:, 2:] // 2
+        depths = sample_depths(depth_image, centers, depth_radius, depth_scale)
+        return kept, rects, centers, depths
+
+# This function builds the BlobDetector of a blob config (min_area, max_area, open_size, close_size, see RealsenseServer.scale_pixel_sizes)
+def make_blob_detector(config, downscale):
+    return BlobDetector(config["min_area"], config["max_area"], downscale, config["open_size"], config["close_size"])
@@ -0,0 +1,107 @@
+import os
+import time
+import numpy as np
+
+from Server.Vision.CourtPlane import CourtPlane
+
+"""
+Everything the RealsenseServer calibrates at start-up, as it is kept between runs.
+
+background is the raw gray collection background, court_corners are the (8, 3) court coordinates of
+CL, CR, STL, STM, STR, SBR, SBM, SBL (None while the court was not locked). The calibration is only
+valid for the camera (serial), stream mode (width, height, fps), intrinsics and camera space it was
+made with.
+"""
+class Calibration:
+
+    def __init__(self, serial, mode, intrinsics, camera_space, background, court_corners=None, court_z=None, plane: CourtPlane = None):
+        self.serial = serial
+        self.mode = tuple(int(v) for v in mode)
+        self.intrinsics = tuple(float(v) for v in intrinsics) # (width, height, fx, fy, ppx, ppy)
+        self.camera_space = camera_space
+        self.background = background
+        self.court_corners = court_corners
+        self.court_z = court_z
+        self.plane = plane
+
+    def has_court(self):
+        return self.court_corners is not None
+
+
+"""
+This class keeps the Calibration in one uncompressed .npz file, so it loads in milliseconds.
+
+The file is versioned and written atomically (a crash while saving keeps the previous file).
+load() validates it against the connected camera and returns None if it does not match, the
+RealsenseServer then falls back to the interactive calibration.
+"""
+class CalibrationStore:
+    VERSION = 1
+    INTRINSICS_TOLERANCE = 1e-3
+
+    def __init__(self, path):
+        self.path = path
+
+    # This function returns the stored Calibration if it was made with this camera, stream mode, intrinsics and camera space
+    def load(self, serial, mode, intrinsics, camera_space):
+        if not os.path.exists(self.path):
+            return None
+
+        start = time.time()
+        try:
+            with np.load(self.path) as data:
+                if int(data["version"]) != self.VERSION:
+                    print(f"calibration store {self.path} has version {int(data['version'])} instead of {self.VERSION}, it is ignored")
+                    return None
+                calibration = Calibration(str(data["serial"]), data["mode"], data["intrinsics"], str(data["camera_space"]), data["background"])
+                if bool(data["has_court"]):
+                    calibration.court_corners = data["court_corners"]
+                    calibration.court_z = float(data["court_z"])
+                    calibration.plane = CourtPlane(data["plane_origin"], data["plane_normal"], data["plane_axis_x"], data["plane_axis_y"],
+                                                   data["plane_camera_matrix"])
+        except (OSError, KeyError, ValueError) as e:
+            print(f"calibration store {self.path} could not be read ({e}), it is ignored")
+            return None
+
+        if calibration.serial != serial:
+            print(f"calibration store {self.path} belongs to camera {calibration.serial}, not {serial}")
+            return None
+        if calibration.mode != tuple(mode) or calibration.camera_space != camera_space:
+            print(f"calibration store {self.path} was made for {calibration.mode} in {calibration.camera_space} space, not {tuple(mode)} in {camera_space} space")
+            return None
+        if not np.allclose(calibration.intrinsics, intrinsics, atol=self.INTRINSICS_TOLERANCE):
+            print(f"calibration store {self.path} has other intrinsics than the camera stream")
+            return None
+
+        print(f"calibration loaded from {self.path} in {(time.time() - start) * 1000:.1f} ms")
+        return calibration
+
+    def save(self, calibration: Calibration):
+        data = {
+            "version": self.VERSION,
+            "serial": calibration.serial,
+            "mode": np.array(calibration.mode),
+            "intrinsics": np.array(calibration.intrinsics),
+            "camera_space": calibration.camera_space,
+            "background": calibration.background,
+            "has_court": calibration.has_court(),
+        }
+        if calibration.has_court():
+            data.update({
+                "court_corners": np.asarray(calibration.court_corners, dtype=np.float64),
+                "court_z": calibration.court_z,
+                "plane_origin": calibration.plane.origin,
+                "plane_normal": calibration.plane.normal,
+                "plane_axis_x": calibration.plane.axis_x,
+                "plane_axis_y": calibration.plane.axis_y,
+                "plane_camera_matrix": calibration.plane.camera_matrix,
+            })
+
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "wb") as file:
+            np.savez(file, **data)
+        os.replace(temporary_path, self.path)
+
+# The stored form of rs.intrinsics
+def intrinsics_tuple(intrinsics):
+    return (intrinsics.width, intrinsics.height, intrinsics.fx, intrinsics.fy, intrinsics.ppx, intrinsics.ppy)
@@ -1,4 +1,5 @@
 import numpy as np
+import cv2
 from Server.Location import CourtLocation, BirdieLocation
 from enum import Enum, auto
 
@@ -8,8 +9,15 @@ class Area(Enum):
     RIGHT_SERVICE = auto()
 
 class Court(CourtLocation):
+    CELL_SIZE = 5 # mm per cell of the area raster
+    AREA_BITS = {Area.ALL: 1, Area.LEFT_SERVICE: 2, Area.RIGHT_SERVICE: 4} # label bit of every area in the raster
+
     def __init__(self):
         self.is_locked = False
+        self.raster = None # label of every court cell (bitwise or of AREA_BITS), see build_raster
+        self.raster_origin = None # court coordinates (mm) of raster cell (0, 0)
+        self.roi = None # (x0, y0, x1, y1) pixel bounding box of the court, see compute_roi
+        self.plane = None # CourtPlane, maps between pixels and court coordinates (mm)
 
     # def set_corners(self, aruco_corners=None, court_corners=None):
     #     if aruco_corners is not None:
@@ -19,6 +27,87 @@ class Court(CourtLocation):
     #     else:
     #         raise Exception("ERROR: Court has to be initialized either with aruco_corners!")
 
+    def set_corners(self, aruco_corners=None, court_corners=None):
+        super().set_corners(aruco_corners=aruco_corners, court_corners=court_corners)
+        self.build_raster()
+
+    def area_polygons(self):
+        return {
+            Area.ALL: [self.STL, self.STR, self.CR, self.CL],
+            Area.LEFT_SERVICE: [self.STL, self.STM, self.SBM, self.SBL],
+            Area.RIGHT_SERVICE: [self.STM, self.STR, self.SBR, self.SBM],
+        }
+
+    def build_raster(self):
+        """
+        Precompute the area labels of the court once the corners are known.
+        Every CELL_SIZE x CELL_SIZE cell stores the bitwise or of the AREA_BITS of all areas it lies in (0 is out),
+        so classifying a point is a single array lookup instead of a polygon test.
+        """
+        polygons = self.area_polygons()
+        corners = np.array([(corner.x, corner.y) for polygon in polygons.values() for corner in polygon], dtype=np.float64)
+        self.raster_origin = corners.min(axis=0)
+        width, height = np.ceil((corners.max(axis=0) - self.raster_origin) / self.CELL_SIZE).astype(int) + 1
+        self.raster = np.zeros((height, width), dtype=np.uint8)
+
+        for area, polygon in polygons.items():
+            cells = np.array([(corner.x, corner.y) for corner in polygon]) - self.raster_origin
+            cells = np.round(cells / self.CELL_SIZE).astype(np.int32)
+            layer = np.zeros_like(self.raster)
+            cv2.fillPoly(layer, [cells], self.AREA_BITS[area])
+            self.raster |= layer
+
+    def classify(self, points):
+        """
+        Look up the area labels of many points at once.
+
+        Parameters:
+        points (array-like): (N, 2) or (N, 3) court coordinates (mm), only x and y are used.
+
+        Returns:
+        ndarray: (N,) bitwise or of the AREA_BITS of all areas each point lies in, 0 if it is out.
+        """
+        points = np.asarray(points, dtype=np.float64)
+        points = points.reshape(len(points), -1)[:, :2]
+        cells = np.round((points - self.raster_origin) / self.CELL_SIZE).astype(np.int64)
+        height, width = self.raster.shape
+        valid = (cells[:, 0] >= 0) & (cells[:, 0] < width) & (cells[:, 1] >= 0) & (cells[:, 1] < height)
+
+        labels = np.zeros(len(points), dtype=np.uint8)
+        labels[valid] = self.raster[cells[valid, 1], cells[valid, 0]]
+        return labels
+
+    def inside(self, points, side: Area):
+        """
+        Returns:
+        ndarray: (N,) True for every point inside the area side.
+        """
+        return (self.classify(points) & self.AREA_BITS[side]) != 0
+
+    def calibrate(self, aruco_corners, plane):
+        """
+        Set the court corners from the court aruco.
+
+        The court is laid out around the aruco in the image (with the tuned CourtLocation.SCALE),
+        the resulting pixel corners are then mapped onto the floor, so all corners are in court coordinates (mm).
+
+        Parameters:
+        aruco_corners (ndarray): (4, 2) pixel corners of the court aruco.
+        plane (CourtPlane): The fitted floor plane.
+        """
+        pixel_corners = np.array([(corner.x, corner.y) for corner in self.calculate_court_corners(aruco_corners)])
+        court_corners = plane.pixels_to_court(pixel_corners)
+        self.plane = plane
+        self.set_corners(court_corners=[(x, y, 0) for x, y in court_corners])
+
+    def pixel_corners(self):
+        """
+        Returns:
+        ndarray: (8, 2) pixel positions of CL, CR, STL, STM, STR, SBR, SBM, SBL.
+        """
+        corners = [self.CL, self.CR, self.STL, self.STM, self.STR, self.SBR, self.SBM, self.SBL]
+        return self.plane.court_to_pixels([(corner.x, corner.y) for corner in corners])
+
     def is_inside(self, birdie: BirdieLocation, side: Area):
         """
         Check if a birdie is inside the court.
@@ -30,29 +119,35 @@ class Court(CourtLocation):
         Returns:
         bool: True if the birdie is inside the court, False otherwise.
         """
-        match side:
-            case Area.ALL:
-                court_2d = [(corner.x, corner.y) for corner in [self.STL, self.STR, self.CR, self.CL]]
-            case Area.LEFT_SERVICE:
-                court_2d = [(corner.x, corner.y) for corner in [self.STL, self.STM, self.SBM, self.SBL]]
-            case Area.RIGHT_SERVICE:
-                court_2d = [(corner.x, corner.y) for corner in [self.SBM, self.STR, self.SBR, self.SBM]]
-            case _:
-                print("ERROR: Invalid parameter for <side> in function <is_inside>")
-                return False
-
-        birdie_2d = [birdie.x, birdie.y]
-
-        inside = True
-        for i in range(len(court_2d)):
-            o = court_2d[i]
-            a = court_2d[(i + 1) % len(court_2d)]
-            if Court.cross(o, a, birdie_2d) < 0:
-                inside = False
-                break
-
-        return inside
+        if side not in self.AREA_BITS:
+            print("ERROR: Invalid parameter for <side> in function <is_inside>")
+            return False
 
+        return bool(self.inside([(birdie.x, birdie.y)], side)[0])
+
+
+    def compute_roi(self, frame_width, frame_height, margin):
+        """
+        Precompute the pixel bounding box of the court (plus margin) that birdie detection is restricted to.
+        This is called once when the court gets locked or loaded, not per frame.
+
+        Parameters:
+        frame_width, frame_height (int): Size of the camera image.
+        margin (int): Pixels added on every side, birdies in the air are seen outside of the court lines.
+
+        Returns:
+        tuple: (x0, y0, x1, y1) clipped to the camera image.
+        """
+        corners = self.pixel_corners()
+        xs = corners[:, 0]
+        ys = corners[:, 1]
+
+        x0 = int(np.clip(min(xs) - margin, 0, frame_width))
+        y0 = int(np.clip(min(ys) - margin, 0, frame_height))
+        x1 = int(np.clip(max(xs) + margin, 0, frame_width))
+        y1 = int(np.clip(max(ys) + margin, 0, frame_height))
+        self.roi = (x0, y0, x1, y1)
+        return self.roi
 
     def which_serve_side(self, birdie: BirdieLocation):
         """
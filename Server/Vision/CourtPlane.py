@@ -0,0 +1,127 @@
+import numpy as np
+import cv2
+
+from Server.Vision.Depth import sample_depths, deproject_pixels
+
+"""
+The court floor as a plane in camera space and the court coordinate system on it.
+
+Court coordinates are millimetres: x and y lie on the floor (the axes follow the image x and y
+direction, so angles keep the orientation they have in the image), z is the height above the floor.
+The origin is the center of the court aruco at calibration time.
+
+Floor pixels map to court coordinates by a homography, so a whole set of pixels is converted with
+one cv2.perspectiveTransform call. Deprojected camera points (e.g. a birdie in the air) are
+converted with one matrix product.
+"""
+class CourtPlane:
+    OUTLIER_DISTANCE = 0.02 # meters, depth samples further away from the fitted floor are dropped for the refit
+
+    def __init__(self, origin, normal, axis_x, axis_y, camera_matrix):
+        self.origin = np.asarray(origin, dtype=np.float64) # meters in camera space, on the floor
+        self.normal = np.asarray(normal, dtype=np.float64) # unit vector, pointing towards the camera
+        self.axis_x = np.asarray(axis_x, dtype=np.float64)
+        self.axis_y = np.asarray(axis_y, dtype=np.float64)
+        self.camera_matrix = np.asarray(camera_matrix, dtype=np.float64)
+
+        # camera space (meters) -> court (mm)
+        self.rotation = np.stack((self.axis_x, self.axis_y, self.normal)) * 1000
+
+        # A floor point origin + (x * axis_x + y * axis_y) / 1000 is seen at pixel K @ [axis_x / 1000, axis_y / 1000, origin] @ (x, y, 1)
+        self.court_to_pixel = self.camera_matrix @ np.column_stack((self.axis_x / 1000, self.axis_y / 1000, self.origin))
+        self.pixel_to_court = np.linalg.inv(self.court_to_pixel)
+
+    @staticmethod
+    def fit(depth_image, depth_scale, intrinsics, marker_corners, region, grid=24):
+        """
+        Fit the floor plane to the depth image inside region and put the origin below the court aruco.
+
+        Parameters:
+        depth_image (ndarray): Raw depth image.
+        marker_corners (ndarray): (4, 2) pixel corners of the court aruco.
+        region (tuple): (x0, y0, x1, y1) pixel area of the floor that is sampled (the court).
+        grid (int): The region is sampled at grid x grid pixels.
+
+        Returns:
+        CourtPlane, or None if there is not enough valid depth in the region.
+        """
+        x0, y0, x1, y1 = region
+        us, vs = np.meshgrid(np.linspace(x0, x1 - 1, grid), np.linspace(y0, y1 - 1, grid))
+        pixels = np.stack((us.ravel(), vs.ravel()), axis=1).astype(np.int64)
+        depths = sample_depths(depth_image, pixels, 2, depth_scale)
+        valid = depths > 0
+        points = deproject_pixels(pixels[valid], depths[valid], intrinsics)
+        if len(points) < 3:
+            return None
+
+        # Least squares plane, refitted without the points that are not floor (players, birdies, the robot)
+        centroid, normal = fit_plane(points)
+        inliers = np.abs((points - centroid) @ normal) < CourtPlane.OUTLIER_DISTANCE
+        if np.count_nonzero(inliers) >= 3:
+            centroid, normal = fit_plane(points[inliers])
+        if normal @ centroid > 0:
+            normal = -normal # the camera is at the camera space origin
+
+        camera_matrix = intrinsics_matrix(intrinsics)
+
+        # The origin is where the ray through the aruco center hits the floor
+        center = np.asarray(marker_corners, dtype=np.float64).mean(axis=0)
+        ray = np.linalg.inv(camera_matrix) @ np.array([center[0], center[1], 1.0])
+        origin = ray * (normal @ centroid) / (normal @ ray)
+
+        # The image axes projected onto the floor
+        axis_x = np.array([1.0, 0.0, 0.0]) - normal[0] * normal
+        axis_x /= np.linalg.norm(axis_x)
+        axis_y = np.array([0.0, 1.0, 0.0]) - normal[1] * normal - axis_x[1] * axis_x
+        axis_y /= np.linalg.norm(axis_y)
+
+        return CourtPlane(origin, normal, axis_x, axis_y, camera_matrix)
+
+    # This function maps (N, 2) floor pixels to (N, 2) court coordinates (mm)
+    def pixels_to_court(self, pixels):
+        pixels = np.asarray(pixels, dtype=np.float64).reshape(-1, 1, 2)
+        return cv2.perspectiveTransform(pixels, self.pixel_to_court).reshape(-1, 2)
+
+    # This function maps (N, 2) court coordinates (mm) on the floor, or (N, 3) court coordinates with height, to (N, 2) pixels
+    def court_to_pixels(self, points):
+        points = np.asarray(points, dtype=np.float64)
+        if points.shape[-1] == 3:
+            # rotation / 1000 is orthonormal, so its transpose maps court back to camera space
+            camera_points = self.origin + points.reshape(-1, 3) @ self.rotation / 1e6
+            pixels = camera_points @ self.camera_matrix.T
+            return pixels[:, :2] / pixels[:, 2:]
+        points = points.reshape(-1, 1, 2)
+        return cv2.perspectiveTransform(points, self.court_to_pixel).reshape(-1, 2)
+
+    # This function maps (N, 3) camera space points (meters) to (N, 3) court coordinates (mm, z is the height above the floor)
+    def camera_to_court(self, points):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        return (points - self.origin) @ self.rotation.T
+
+    # This function returns the same floor seen through a camera stream with other intrinsics (e.g. another resolution)
+    def for_intrinsics(self, intrinsics):
+        return CourtPlane(self.origin, self.normal, self.axis_x, self.axis_y, intrinsics_matrix(intrinsics))
+
+    def to_dict(self):
+        return {
+            "origin": self.origin.tolist(),
+            "normal": self.normal.tolist(),
+            "axis_x": self.axis_x.tolist(),
+            "axis_y": self.axis_y.tolist(),
+            "camera_matrix": self.camera_matrix.tolist(),
+        }
+
+    @staticmethod
+    def from_dict(data):
+        return CourtPlane(data["origin"], data["normal"], data["axis_x"], data["axis_y"], data["camera_matrix"])
+
+# This function returns the centroid and the unit normal of the least squares plane through (N, 3) points
+def fit_plane(points):
+    centroid = points.mean(axis=0)
+    _, _, vt = np.linalg.svd(points - centroid)
+    return centroid, vt[2]
+
+def intrinsics_matrix(intrinsics):
+    return np.array([[intrinsics.fx, 0, intrinsics.ppx],
+                     [0, intrinsics.fy, intrinsics.ppy],
+                     [0, 0, 1]])
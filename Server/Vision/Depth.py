@@ -0,0 +1,41 @@
+import numpy as np
+
+"""
+Batched depth helpers, so per frame depth work is a few NumPy calls instead of one
+get_distance / rs2_deproject_pixel_to_point call per detected blob.
+"""
+
+# This function returns a robust depth (in meters) for every center: the median of all valid (non zero)
+# depth values in a (2 * radius + 1)^2 window around it. Centers without any valid depth get 0.
+def sample_depths(depth_image, centers, radius, depth_scale):
+    centers = np.asarray(centers, dtype=np.int64).reshape(-1, 2)
+    height, width = depth_image.shape[:2]
+
+    offsets = np.arange(-radius, radius + 1)
+    xs = np.clip(centers[:, 0, None] + offsets[None, :], 0, width - 1)
+    ys = np.clip(centers[:, 1, None] + offsets[None, :], 0, height - 1)
+
+    # (N, window * window) depth values of all windows gathered at once
+    windows = depth_image[ys[:, :, None], xs[:, None, :]].reshape(len(centers), -1).astype(np.float32)
+
+    # Median over the valid values only: zeros are sorted to the end, then pick the middle valid entries
+    valid = np.count_nonzero(windows, axis=1)
+    windows[windows == 0] = np.inf
+    windows.sort(axis=1)
+    rows = np.arange(len(centers))
+    low = np.maximum(valid - 1, 0) // 2
+    high = valid // 2
+    medians = (windows[rows, low] + windows[rows, high]) / 2
+    medians[valid == 0] = 0
+
+    return medians * depth_scale
+
+# This function deprojects pixel centers with their depth (in meters) into camera space points (N, 3)
+# using the pinhole model of the stream intrinsics (the D4xx streams have no or negligible distortion)
+def deproject_pixels(pixels, depths, intrinsics):
+    pixels = np.asarray(pixels, dtype=np.float64).reshape(-1, 2)
+    depths = np.asarray(depths, dtype=np.float64)
+
+    x = (pixels[:, 0] - intrinsics.ppx) / intrinsics.fx * depths
+    y = (pixels[:, 1] - intrinsics.ppy) / intrinsics.fy * depths
+    return np.stack((x, y, depths), axis=1)
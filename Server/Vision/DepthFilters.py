@@ -0,0 +1,46 @@
+import pyrealsense2 as rs
+
+"""
+Depth post-processing chain of the RealsenseServer.
+
+The configuration maps filter names to their rs.option values, e.g. {"spatial": {"filter_magnitude": 2}}.
+The filters always run in the order Intel recommends: decimation, spatial and temporal filtering in
+disparity space, hole filling. They are applied to the whole frameset before the depth is aligned to
+color, so the aligned depth has the color resolution even with decimation. Without alignment the decimated
+depth would not match the color pixels the blobs are measured at, so decimation requires aligned depth.
+"""
+FILTER_ORDER = ["decimation", "spatial", "temporal", "hole_filling"]
+FILTER_TYPES = {
+    "decimation": rs.decimation_filter,
+    "spatial": rs.spatial_filter,
+    "temporal": rs.temporal_filter,
+    "hole_filling": rs.hole_filling_filter,
+}
+
+# This function builds the processing blocks of a filter configuration in their order
+# aligned tells if the filtered depth is aligned to color afterwards
+def make_depth_filters(config, aligned=True):
+    if "decimation" in config and not aligned:
+        raise ValueError("Depth decimation changes the depth resolution, it can only be used with align_depth")
+    filters = []
+    in_disparity = False
+    for name in FILTER_ORDER:
+        if name not in config:
+            continue
+        needs_disparity = name in ("spatial", "temporal")
+        if needs_disparity != in_disparity:
+            filters.append(rs.disparity_transform(needs_disparity))
+            in_disparity = needs_disparity
+        depth_filter = FILTER_TYPES[name]()
+        for option, value in config[name].items():
+            depth_filter.set_option(getattr(rs.option, option), value)
+        filters.append(depth_filter)
+    if in_disparity:
+        filters.append(rs.disparity_transform(False))
+    return filters
+
+# This function runs the filters on the depth frame of a frameset and returns the filtered frameset
+def apply_depth_filters(filters, frames):
+    for depth_filter in filters:
+        frames = depth_filter.process(frames).as_frameset()
+    return frames
@@ -0,0 +1,42 @@
+import numpy as np
+import cv2
+
+"""
+This class turns depth pixels into heights above the court floor.
+
+A pixel (u, v) with depth z (meters) is the camera space point z * r with the ray r = K^-1 (u, v, 1).
+Its height above the floor plane (unit normal n towards the camera, origin o on the floor) is
+z * (n . r) - n . o, so n . r is precomputed once per pixel when the court is locked and a height is
+one multiply-add per pixel.
+
+A birdie's height is an upper percentile of the heights of the valid depth pixels inside its contour:
+depth holes (0) are skipped, and pixels where the thin feathers let the floor shine through only pull
+the low percentiles down.
+"""
+class FloorHeightMap:
+
+    def __init__(self, plane, width, height, percentile=75, min_pixels=5):
+        self.percentile = percentile
+        self.min_pixels = min_pixels # blobs with less valid depth pixels get no height
+
+        camera_matrix = plane.camera_matrix
+        us, vs = np.meshgrid(np.arange(width, dtype=np.float64), np.arange(height, dtype=np.float64))
+        rays_x = (us - camera_matrix[0, 2]) / camera_matrix[0, 0]
+        rays_y = (vs - camera_matrix[1, 2]) / camera_matrix[1, 1]
+        self.ray_dot_normal = (plane.normal[0] * rays_x + plane.normal[1] * rays_y + plane.normal[2]).astype(np.float32)
+        self.floor_offset = float(plane.normal @ plane.origin)
+
+    # This function returns the height (mm) above the floor of every blob, NaN if a blob has too little valid depth
+    def blob_heights(self, depth_image, rects, contours, depth_scale):
+        heights = np.full(len(rects), np.nan)
+        for i, (rect, contour) in enumerate(zip(rects, contours)):
+            x, y, w, h = (int(v) for v in rect)
+            mask = np.zeros((h, w), dtype=np.uint8)
+            cv2.drawContours(mask, [contour], -1, 255, -1, offset=(-x, -y))
+            depth = depth_image[y:y + h, x:x + w]
+            valid = (mask > 0) & (depth > 0)
+            if np.count_nonzero(valid) < self.min_pixels:
+                continue
+            pixel_heights = (depth[valid] * depth_scale * self.ray_dot_normal[y:y + h, x:x + w][valid] - self.floor_offset) * 1000
+            heights[i] = np.percentile(pixel_heights, self.percentile)
+        return heights
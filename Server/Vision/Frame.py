@@ -0,0 +1,16 @@
+import time
+
+"""
+This class is one depth + color frameset as it is handed out by the frame bus of the RealsenseServer.
+
+seq is increased by one for every captured frameset, so every consumer (aruco detection,
+hit birdie tracking, collection detection) can remember the last seq it processed and
+knows whether it already worked on a frame.
+"""
+class Frame:
+    def __init__(self, seq, depth_frame, color_image, timestamp=None):
+        self.seq = seq
+        self.depth_frame = depth_frame
+        self.color_image = color_image
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.arucos = None # (corners, ids) once the aruco markers of this frame were detected
@@ -0,0 +1,104 @@
+import threading
+from collections import deque
+
+from Server.Vision.Frame import Frame
+
+"""
+This class runs the camera acquisition on its own thread.
+
+Captured framesets are stored in a small ring buffer (latest wins, the oldest frames are dropped),
+so the control loop never waits on camera I/O and always works on the freshest frame.
+If publish is set, every new frame is also handed to it (e.g. to copy it into the shared memory of the vision pool).
+If is_finished is set, it is asked after a failed capture whether the stream ended (e.g. a playback reached the end
+of the recording). The thread then stops and finished is set, so waiting consumers are woken up.
+"""
+class FrameGrabber(threading.Thread):
+
+    def __init__(self, capture, buffer_size=4, publish=None, is_finished=None):
+        super().__init__(daemon=True)
+        self.capture = capture # function returning (depth_frame, color_image) or None
+        self.publish = publish # function called with every new Frame
+        self.is_finished = is_finished # function returning True once the stream ended
+        self.finished = threading.Event()
+        self.buffer = deque(maxlen=buffer_size)
+        self.seq = 0
+        self.running = False
+        self.lock = threading.Lock()
+        self.frame_arrived = threading.Condition(self.lock)
+        self.active = threading.Event() # cleared while the camera pipeline is restarted
+        self.active.set()
+        self.capturing = threading.Lock() # held while capture runs
+
+    def run(self):
+        self.running = True
+        while self.running:
+            self.active.wait()
+            with self.capturing:
+                if self.active.is_set():
+                    self.grab()
+
+    def grab(self):
+        try:
+            captured = self.capture()
+        except RuntimeError as e:
+            if self.is_finished is not None and self.is_finished():
+                # The stream ended, no frame will arrive anymore
+                self.running = False
+                with self.lock:
+                    self.finished.set()
+                    self.frame_arrived.notify_all()
+                return
+            # wait_for_frames timed out, keep the thread alive
+            print(f"FrameGrabber: {e}")
+            return
+        if captured is None:
+            return
+        depth_frame, color_image = captured
+        frame = Frame(self.seq + 1, depth_frame, color_image)
+        # Publish before the frame is visible in the buffer, so a job for it always finds it in the shared memory
+        if self.publish is not None:
+            self.publish(frame)
+        with self.lock:
+            self.seq = frame.seq
+            self.buffer.append(frame)
+            self.frame_arrived.notify_all()
+
+    def stop(self):
+        self.running = False
+        self.active.set()
+        self.join(timeout=1)
+
+    # This function blocks until the thread is out of capture and keeps it from capturing until resume.
+    # The buffered frames are dropped, they belong to the stream that is about to be changed.
+    def pause(self):
+        self.active.clear()
+        with self.capturing:
+            with self.lock:
+                self.buffer.clear()
+
+    def resume(self):
+        self.active.set()
+
+    # This function returns the newest frame without blocking (None if nothing was captured yet)
+    def latest_frame(self):
+        with self.lock:
+            return self.buffer[-1] if len(self.buffer) > 0 else None
+
+    # This function returns all buffered frames newer than seq (oldest first)
+    def frames_since(self, seq):
+        with self.lock:
+            return [frame for frame in self.buffer if frame.seq > seq]
+
+    # This function returns the buffered frame seq (None if it is not buffered anymore)
+    def frame(self, seq):
+        with self.lock:
+            for frame in self.buffer:
+                if frame.seq == seq:
+                    return frame
+        return None
+
+    # This function blocks until a frame newer than seq arrived (or the stream finished) and returns the newest frame
+    def wait_for_frame(self, seq, timeout=1.0):
+        with self.lock:
+            self.frame_arrived.wait_for(lambda: (len(self.buffer) > 0 and self.buffer[-1].seq > seq) or self.finished.is_set(), timeout)
+            return self.buffer[-1] if len(self.buffer) > 0 else None
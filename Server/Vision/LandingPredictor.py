@@ -0,0 +1,67 @@
+import numpy as np
+from Server.Location import Position
+
+"""
+This class predicts where and when an in-flight birdie is going to hit the ground.
+
+Each axis is modelled as a second order polynomial in time (ballistic motion, the drag of the
+shuttle is absorbed into the fitted coefficients). The coefficients are fitted incrementally with
+recursive least squares: every frame costs a few 3x3 operations, independent of the history length.
+A forgetting factor < 1 down-weights old samples, so the fit follows the shuttle when drag bends the
+trajectory.
+"""
+class LandingPredictor:
+
+    def __init__(self, tolerance, forgetting=0.9, min_samples=4, full_confidence_samples=8):
+        self.tolerance = tolerance # residual (in z units) at which the confidence is halved
+        self.forgetting = forgetting
+        self.min_samples = min_samples
+        self.full_confidence_samples = full_confidence_samples
+
+        self.t0 = None
+        self.samples = 0
+        self.theta = np.zeros((3, 3)) # rows: (a, b, c) of a + b*t + c*t^2, columns: x, y, z
+        self.P = np.eye(3) * 1e6 # inverse information matrix (the same regressor is shared by all axes)
+        self.residual = np.zeros(3) # running mean of the squared innovation per axis
+
+    def update(self, t, x, y, z):
+        if self.t0 is None:
+            self.t0 = t
+        tau = t - self.t0
+        phi = np.array([1.0, tau, tau * tau])
+        position = np.array([x, y, z], dtype=np.float64)
+
+        error = position - phi @ self.theta
+        if self.samples >= self.min_samples:
+            self.residual = 0.7 * self.residual + 0.3 * error ** 2
+
+        P_phi = self.P @ phi
+        gain = P_phi / (self.forgetting + phi @ P_phi)
+        self.theta += np.outer(gain, error)
+        self.P = (self.P - np.outer(gain, P_phi)) / self.forgetting
+        self.samples += 1
+
+    # This function returns the confidence (0..1) of the current fit
+    def confidence(self):
+        if self.samples < self.min_samples:
+            return 0.0
+        sample_confidence = min(1.0, self.samples / self.full_confidence_samples)
+        return sample_confidence / (1.0 + np.sqrt(self.residual[2]) / self.tolerance)
+
+    # This function predicts the impact with the plane z = ground_z after time now.
+    # Returns (impact position, impact time, confidence) or None if the fit does not reach the ground within horizon seconds.
+    def predict(self, now, ground_z, horizon=2.0):
+        if self.samples < self.min_samples:
+            return None
+
+        tau_now = now - self.t0
+        a, b, c = self.theta[:, 2]
+        roots = np.roots([c, b, a - ground_z]) if abs(c) > 1e-12 else np.roots([b, a - ground_z])
+        roots = [root.real for root in roots if abs(root.imag) < 1e-9 and tau_now <= root.real <= tau_now + horizon]
+        if len(roots) == 0:
+            return None
+
+        tau_impact = min(roots)
+        phi = np.array([1.0, tau_impact, tau_impact * tau_impact])
+        impact_x, impact_y, _ = phi @ self.theta
+        return Position(impact_x, impact_y, ground_z), self.t0 + tau_impact, self.confidence()
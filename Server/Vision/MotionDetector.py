@@ -0,0 +1,39 @@
+import math
+
+"""
+This class decides whether the tracked birdies stopped moving.
+
+It keeps the last position of every track and counts the consecutive frames in which nothing
+moved, so updating costs O(1) per track and frame and memory stays bounded.
+The scene is static once the set of tracks did not change and no track moved more than
+still_distance between two frames for window consecutive frames.
+"""
+class MotionDetector:
+
+    def __init__(self, window, still_distance):
+        self.window = window
+        self.still_distance = still_distance
+        self.reset()
+
+    def reset(self):
+        self.last_positions = {} # track id -> (x, y)
+        self.still_frames = 0
+
+    def update(self, birdies):
+        ids = set(birdie.id for birdie in birdies)
+        moved = ids != set(self.last_positions.keys()) # a birdie appeared or disappeared
+
+        for birdie in birdies:
+            last = self.last_positions.get(birdie.id)
+            self.last_positions[birdie.id] = (birdie.x, birdie.y)
+            if last is not None and math.hypot(birdie.x - last[0], birdie.y - last[1]) > self.still_distance:
+                moved = True
+
+        # Forget the tracks that are gone
+        for gone_id in set(self.last_positions.keys()) - ids:
+            del self.last_positions[gone_id]
+
+        self.still_frames = 0 if moved else self.still_frames + 1
+
+    def is_static(self):
+        return self.still_frames >= self.window
@@ -0,0 +1,122 @@
+import math
+import numpy as np
+
+"""
+Extended Kalman filter for the robot pose.
+
+State: (x, y, theta, v, omega) of a unicycle model. The filter is corrected with the
+aruco observations (x, y, theta). The motion the robot was commanded to do is the control
+input: while a command is known, v and omega follow it (with speed_noise / turn_rate_noise
+as process noise), otherwise they drift as a random walk.
+The filter state stays at the time of the last observation, predicted_pose extrapolates
+it to any later point in time (between two camera frames or while the marker is not detected).
+"""
+class PoseFilter:
+    X, Y, THETA, V, OMEGA = range(5)
+
+    def __init__(self, position_noise, angle_noise, acceleration_noise, angular_acceleration_noise,
+                 speed_noise, turn_rate_noise, distance_scale=1.0):
+        self.R_observation = np.diag([position_noise ** 2, position_noise ** 2, angle_noise ** 2])
+        self.Q_command = np.diag([speed_noise ** 2, turn_rate_noise ** 2])
+        self.acceleration_noise = acceleration_noise
+        self.angular_acceleration_noise = angular_acceleration_noise
+        self.distance_scale = distance_scale # position units per mm (commands are in mm/s)
+
+        self.state = None
+        self.P = None
+        self.time = None
+        self.command = None # commanded (v, omega) in position units, None if unknown
+
+    def is_initialized(self):
+        return self.state is not None
+
+    def initialize(self, t, x, y, theta):
+        self.state = np.array([x, y, theta, 0.0, 0.0])
+        self.P = np.diag([self.R_observation[0, 0], self.R_observation[1, 1], self.R_observation[2, 2], 1.0, 1.0])
+        self.time = t
+
+    # This function moves the state forward to time t
+    def predict(self, t):
+        if self.state is None or t <= self.time:
+            return
+        self.state, self.P = self._propagate(t - self.time)
+        self.time = t
+
+    # This function returns the (x, y, theta) pose predicted for time t without changing the filter
+    def predicted_pose(self, t):
+        if self.state is None or t <= self.time:
+            return self.pose()
+        state, _ = self._propagate(t - self.time)
+        return state[PoseFilter.X], state[PoseFilter.Y], state[PoseFilter.THETA]
+
+    # This function returns the state and covariance dt seconds after the current state
+    def _propagate(self, dt):
+        x, y, theta, v, omega = self.state
+        if self.command is not None:
+            v, omega = self.command
+        cos_theta, sin_theta = math.cos(theta), math.sin(theta)
+        state = np.array([x + v * cos_theta * dt, y + v * sin_theta * dt, wrap_angle(theta + omega * dt), v, omega])
+
+        F = np.eye(5)
+        F[PoseFilter.X, PoseFilter.THETA] = -v * sin_theta * dt
+        F[PoseFilter.Y, PoseFilter.THETA] = v * cos_theta * dt
+        if self.command is None:
+            F[PoseFilter.X, PoseFilter.V] = cos_theta * dt
+            F[PoseFilter.Y, PoseFilter.V] = sin_theta * dt
+            F[PoseFilter.THETA, PoseFilter.OMEGA] = dt
+            Q = np.diag([0.0, 0.0, 0.0, (self.acceleration_noise * dt) ** 2, (self.angular_acceleration_noise * dt) ** 2])
+        else:
+            # The commanded motion is the control input, how closely the robot follows it is the process noise
+            F[3:, 3:] = 0
+            G = np.array([[cos_theta * dt, 0], [sin_theta * dt, 0], [0, dt], [1, 0], [0, 1]])
+            Q = G @ self.Q_command @ G.T
+        return state, F @ self.P @ F.T + Q
+
+    # This function fuses an aruco observation taken at time t.
+    # An observation older than the filter state (out of order) can not be fused anymore and is rejected, returns False then.
+    def correct(self, t, x, y, theta):
+        if self.state is None:
+            self.initialize(t, x, y, theta)
+            return True
+        if t < self.time:
+            return False
+        self.predict(t)
+
+        H = np.zeros((3, 5))
+        H[0, PoseFilter.X] = 1
+        H[1, PoseFilter.Y] = 1
+        H[2, PoseFilter.THETA] = 1
+        innovation = np.array([x, y, theta]) - self.state[:3]
+        innovation[2] = wrap_angle(innovation[2])
+        self._correct(H, innovation, self.R_observation)
+        return True
+
+    def _correct(self, H, innovation, R):
+        S = H @ self.P @ H.T + R
+        K = self.P @ H.T @ np.linalg.inv(S)
+        self.state = self.state + K @ innovation
+        self.state[PoseFilter.THETA] = wrap_angle(self.state[PoseFilter.THETA])
+        self.P = (np.eye(5) - K @ H) @ self.P
+
+    # This function is registered at the RobotCommander and translates the sent commands into the expected motion
+    def apply_command(self, command):
+        if not hasattr(command, "motion"):
+            return # the command does not change how the robot moves
+        motion = command.motion()
+        if motion is None:
+            self.command = None
+        else:
+            speed, turn_rate = motion
+            self.command = (speed * self.distance_scale, turn_rate)
+
+    def pose(self):
+        return self.state[PoseFilter.X], self.state[PoseFilter.Y], self.state[PoseFilter.THETA]
+
+    def velocity(self):
+        return self.state[PoseFilter.V], self.state[PoseFilter.OMEGA]
+
+    def covariance(self):
+        return self.P.copy()
+
+def wrap_angle(angle):
+    return (angle + math.pi) % (2 * math.pi) - math.pi
@@ -1,27 +1,63 @@
 import select
-import json
+import time
 import pyrealsense2 as rs
 import numpy as np
 import os
 import cv2
+from collections import deque
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 from typing import Dict
 
-from Server.Location import RobotLocation
+from Server.Location import RobotLocation, Position
 from Server.Vision.Court import Court
+from Server.Vision.CourtPlane import CourtPlane
 from Server.Vision.Birdie import Birdie
+from Server.Vision.BackgroundModel import BackgroundModel
+from Server.Vision.BlobDetector import BlobDetector, make_blob_detector
+from Server.Vision.BirdieTracker import BirdieTracker
+from Server.Vision.MotionDetector import MotionDetector
+from Server.Vision.PoseFilter import PoseFilter
+from Server.Vision.Frame import Frame
+from Server.Vision.FrameGrabber import FrameGrabber
+from Server.Vision.VisionPool import VisionPool
+from Server.Vision.Aruco import make_aruco_detector, detect_markers
+from Server.Vision.StreamProfiles import supported_modes, select_mode
+from Server.Vision.DepthFilters import make_depth_filters, apply_depth_filters
+from Server.Vision.FloorHeightMap import FloorHeightMap
+from Server.Vision.CalibrationStore import Calibration, CalibrationStore, intrinsics_tuple
+from Server.Vision.Depth import deproject_pixels
+from Server.Vision.Viewer import Viewer, draw_court, draw_hit_view, draw_collection_view, draw_mask
 """
 This class is used to track:
     - the robot position (aruco marker)
     - the court position (all relevant points) (aruco marker)
     - the birdie positions (timestep, id, x, y, z)
 
+All positions are court coordinates in mm (see CourtPlane), z is the height above the floor.
+
 This class exposes the information of the objects.
+
+With vision_workers > 0 the aruco and birdie image work runs in a VisionPool of that many worker
+processes (this implies threaded capture). The detection functions then hand the newest frame to
+the pool and apply the newest finished result, so they do not block on the image work.
+
+The camera runs in one of the SENSOR_PROFILES (see StreamProfiles), select_profile switches
+between them, e.g. to a high frame rate mode while birdies are hit.
+
+With align_depth the depth frames are aligned to the color stream, so a color image pixel
+(aruco corner, birdie contour) indexes the depth image at the same pixel and all deprojection
+happens in color camera space.
+
+With depth_filtering the depth frames run through the DEPTH_FILTERS chain of the current profile.
+Once the court is locked, a FloorHeightMap gives every blob its height above the floor from all
+valid depth pixels inside its contour.
 """
 class RealsenseServer:
 
-    def __init__(self, robotArucoId, courtArucoId, minAreaThreshold = 500, maxAreaThreshold = 8000):
+    def __init__(self, robotArucoId, courtArucoId, minAreaThreshold = 500, maxAreaThreshold = 8000, threaded_capture = False, headless = False,
+                 record_path = None, playback_path = None, playback_realtime = True, vision_workers = 0, profile = "collection",
+                 align_depth = True, depth_filtering = True):
         # ================
         # Data
         # ================
@@ -32,20 +68,86 @@ class RealsenseServer:
         # self.CurrentTime = 0
         self.robotArucoId = robotArucoId
         self.courtArucoId = courtArucoId
-        self.minAreaThreshold = minAreaThreshold
+        self.minAreaThreshold = minAreaThreshold # blob area limits in pixels at REFERENCE_WIDTH
         self.maxAreaThreshold = maxAreaThreshold
         self.robotArucoVisible = None
         self.courtArucoVisible = None
         self.courtArucoHasBeenFound = False
         self.robot: RobotLocation = None
-        self.tracked_hitbirdie = None
+        self.robot_pixel = None # last pixel center of the robot aruco (None if it was lost)
+        self.robot_marker_size = None # side length of the robot aruco in pixels
+        self.frames_since_full_aruco_search = 0
         self.court: Court = Court()
-        self.contour_history = []
+
+        # Frame bus
+        self.frame: Frame = None
+        self.frame_seq = 0
+        self.last_aruco_seq = -1
+        self.last_hitbirdie_seq = -1
+        self.last_collection_seq = -1
+        self.frame_grabber: FrameGrabber = None
+        self.vision_pool: VisionPool = None
+        self.headless = headless
+        self.viewer: Viewer = None
 
         # Config
-        self.LIFETIME_THRESHOLD = 3
-        self.BackgroundFilePath = "BackgroundImage.png"
-        self.court_pos_file_path = "court_position.json"
+        self.LIFETIME_THRESHOLD = 3 # frames a birdie track survives without a detection
+        self.TRACK_GATE = 150 # maximum distance (mm) a birdie moves between two frames
+        self.PREDICTION_CONFIDENCE = 0.6 # report a landing early once the predicted impact is this confident
+        self.PREDICTION_HORIZON = 0.3 # ... and at most this many seconds away
+        self.STILLNESS_WINDOW = 10 # frames without birdie movement until the scene counts as static
+        self.STILL_DISTANCE = 2 # maximum movement (mm) between two frames of a birdie at rest
+        self.GROUND_HEIGHT = 150 # a birdie lower than this (mm above the floor) has landed
+        self.ROBOT_MASK_MARGIN = 30 # mm around the robot footprint that is not searched for collection birdies
+        # Background models (thresholds are gray value differences, the adaptive threshold never goes below them)
+        self.HIT_THRESHOLD = 45
+        self.COLLECTION_THRESHOLD = 100
+        self.BACKGROUND_DOWNSCALE = 2 # the background models work on images downscaled by this factor
+        self.BACKGROUND_LEARNING_RATE = 0.005 # per frame weight of a new frame in the running mean / variance
+        self.ARUCO_FULL_SEARCH_INTERVAL = 30 # frames between full frame aruco searches while the robot is tracked in a window
+        self.ARUCO_WINDOW_SCALE = 3 # half size of the robot search window in robot marker sizes
+        self.ARUCO_WINDOW_MIN = 60 # minimum half size of the robot search window in pixels
+        # Robot pose filter (positions in mm, angles in radians)
+        self.POSE_POSITION_NOISE = 2 # aruco center noise
+        self.POSE_ANGLE_NOISE = 0.05 # aruco angle noise
+        self.POSE_ACCELERATION_NOISE = 20 # mm/s^2
+        self.POSE_ANGULAR_ACCELERATION_NOISE = 1.0 # rad/s^2
+        self.POSE_SPEED_NOISE = 3 # how closely the robot follows the commanded speed (mm/s)
+        self.POSE_TURN_RATE_NOISE = 0.1 # ... and turn rate (rad/s)
+        self.FRAME_BUFFER_SIZE = 4
+        self.VISION_RING_SLOTS = 8 # shared memory frame slots of the vision pool (also the frame buffer size with a pool)
+        self.VIEWER_MAX_FPS = 15
+        # Candidate (width, height, fps) modes per sensor profile, the first one the camera supports is used
+        self.SENSOR_PROFILES = {
+            "hit": [(848, 480, 90), (848, 480, 60), (640, 480, 60), (1280, 720, 30)], # fast birdies in flight
+            "collection": [(1280, 720, 30), (848, 480, 30)], # calibration and collection
+        }
+        self.FPS_WINDOW = 60 # frames the delivered frame rate is measured over
+        self.PROFILE_SETTLE_FRAMES = 2 # frames dropped after a profile switch (the exposure is kept, so it settles fast)
+        # Depth post-processing per sensor profile: filter name -> rs.option values (see DepthFilters)
+        # Decimation lowers the depth resolution, it can only be used with align_depth (make_depth_filters raises otherwise)
+        self.DEPTH_FILTERS = {
+            # No temporal filter: it blends in earlier frames and lags behind birdies in flight
+            "hit": {"spatial": {"filter_magnitude": 2, "filter_smooth_alpha": 0.5, "filter_smooth_delta": 20}, "hole_filling": {"holes_fill": 1}},
+            "collection": {"spatial": {"filter_magnitude": 2, "filter_smooth_alpha": 0.5, "filter_smooth_delta": 20},
+                           "temporal": {"filter_smooth_alpha": 0.4, "filter_smooth_delta": 20}, "hole_filling": {"holes_fill": 1}},
+        }
+        self.HEIGHT_PERCENTILE = 75 # a blob's height is this percentile of the heights of its depth pixels
+        self.HEADLESS_COURT_LOCK_FRAMES = 30
+        # The pixel sizes are tuned for REFERENCE_WIDTH wide images, scale_pixel_sizes adapts them to the stream resolution
+        self.REFERENCE_WIDTH = 1280
+        self.ROI_MARGIN = 100 # pixels around the court that are still searched for birdies
+        self.DEPTH_SAMPLE_RADIUS = 3 # birdie depth is the median of the valid depth values in a 7x7 window
+        self.BLOB_OPEN_SIZE = 5 # opening kernel of the blob masks (removes noise)
+        self.BLOB_CLOSE_SIZE = 10 # closing kernel of the blob masks (merges the head and the feathers of the birdie)
+        self.CalibrationFilePath = "calibration.npz"
+        self.BackgroundFilePath = "BackgroundImage.png" # only read if there is no valid calibration store
+        self.blob_detector: BlobDetector = None # built for the stream resolution, see scale_pixel_sizes
+        self.birdie_tracker = BirdieTracker(self.TRACK_GATE, self.LIFETIME_THRESHOLD, self.PREDICTION_CONFIDENCE, self.PREDICTION_HORIZON)
+        self.motion_detector = MotionDetector(self.STILLNESS_WINDOW, self.STILL_DISTANCE)
+        self.pose_filter = PoseFilter(self.POSE_POSITION_NOISE, self.POSE_ANGLE_NOISE,
+                                      self.POSE_ACCELERATION_NOISE, self.POSE_ANGULAR_ACCELERATION_NOISE,
+                                      self.POSE_SPEED_NOISE, self.POSE_TURN_RATE_NOISE)
 
         # ================
         # Realsense Setup
@@ -53,7 +155,27 @@ class RealsenseServer:
         # Configure depth and color streams
         self.pipeline = rs.pipeline()
         self.config = rs.config()
-        self.depth_intrinsics = None
+        self.depth_intrinsics = None # intrinsics of the depth image pixels (the color intrinsics if depth is aligned)
+        self.intrinsics_cache = {} # (stream, width, height, fps) -> intrinsics of that stream profile
+        self.depth_scale = None
+        self.align = rs.align(rs.stream.color) if align_depth else None
+        self.depth_filtering = depth_filtering
+        self.depth_filters = [] # processing blocks of the current profile, see select_depth_filters
+        self.height_map: FloorHeightMap = None
+        self.camera_space = "color" if align_depth else "depth" # the camera space the court plane is fitted in
+        self.image_size = None # (width, height) of the current streams
+        self.frame_times = deque(maxlen=self.FPS_WINDOW)
+        self.is_playback = playback_path is not None
+        self.is_recording = record_path is not None
+        self.profile_name = None
+        self.profile_modes = {} # profile name -> (width, height, fps) supported by the camera
+
+        # Record / replay: the .bag file contains the depth and color streams including their intrinsics,
+        # so a recording can be fed through capture_frame() without a camera attached
+        if self.is_playback:
+            self.config.enable_device_from_file(playback_path, repeat_playback=False)
+        elif record_path is not None:
+            self.config.enable_record_to_file(record_path)
 
         # Get device product line for setting a supporting resolution
         pipeline_wrapper = rs.pipeline_wrapper(self.pipeline)
@@ -70,80 +192,393 @@ class RealsenseServer:
             print("The demo requires Depth camera with Color sensor")
             exit(0)
 
-        self.config.enable_stream(rs.stream.depth, 1280, 720, rs.format.z16, 30)
-        self.config.enable_stream(rs.stream.color, 1280, 720, rs.format.bgr8, 30)
+        # A recording replays the streams it was recorded with
+        if not self.is_playback:
+            modes = supported_modes(device)
+            for name, candidates in self.SENSOR_PROFILES.items():
+                mode = select_mode(candidates, modes)
+                if mode is None:
+                    raise Exception(f"The {device_product_line} camera supports none of the {name} profile modes {candidates}")
+                self.profile_modes[name] = mode
+                print(f"Sensor profile {name}: {mode[0]}x{mode[1]} @ {mode[2]} fps ({device_product_line})")
+            self.profile_name = profile
+            self.enable_streams(self.profile_modes[profile])
 
         # ArUco
-        arucoDict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_6X6_250)
-        arucoParams = cv2.aruco.DetectorParameters()
-        self.arucoDetector = cv2.aruco.ArucoDetector(arucoDict, arucoParams)
+        self.arucoDetector = make_aruco_detector()
 
         # Start streaming
-        self.pipeline.start(self.config)
-
-        ### get the background frame:
-        for i in range(16):
-            self.pipeline.wait_for_frames()
-
-        if os.path.exists(self.BackgroundFilePath):
-            self.background = cv2.imread(self.BackgroundFilePath)
-            self.background = cv2.cvtColor(self.background, cv2.COLOR_BGR2GRAY)
+        pipeline_profile = self.pipeline.start(self.config)
+        self.depth_scale = pipeline_profile.get_device().first_depth_sensor().get_depth_scale()
+        self.apply_stream_profile(pipeline_profile)
+
+        if self.is_playback:
+            # Non realtime playback delivers every recorded frame as fast as it is consumed
+            pipeline_profile.get_device().as_playback().set_real_time(playback_realtime)
+
+        # Warm start: a calibration made with this camera, stream and camera space is loaded from the store and
+        # the exposure settling, the background capture and the court orientation are skipped
+        self.camera_serial = str(device.get_info(rs.camera_info.serial_number))
+        self.calibration_mode = self.stream_mode
+        self.calibration_intrinsics = self.depth_intrinsics
+        self.calibration_store = CalibrationStore(self.CalibrationFilePath)
+        calibration = self.calibration_store.load(self.camera_serial, self.stream_mode, intrinsics_tuple(self.depth_intrinsics), self.camera_space)
+        if calibration is not None:
+            background = calibration.background
         else:
-            frames = self.pipeline.wait_for_frames()
-            color_frame = frames.get_color_frame()
-            background = np.asanyarray(color_frame.get_data())
-            self.background = cv2.cvtColor(background, cv2.COLOR_BGR2GRAY)
-            cv2.imwrite(self.BackgroundFilePath, self.background)
-
-        ### get the court coordinates from json file
-        if os.path.exists(self.court_pos_file_path):
-            print("court object loaded from json file")
-            with open(self.court_pos_file_path, "r") as file:
-                loaded_data = json.load(file)
-                self.court_z = loaded_data.pop("Z")
-                court_corners = [corner for corner in loaded_data.values()]
-                self.court.set_corners(court_corners=court_corners)
+            if not self.is_playback:
+                ### get the background frame (give the auto exposure some frames to settle):
+                for i in range(16):
+                    self.pipeline.wait_for_frames()
+            background = self.load_background_image()
+        # The collection background adapts while the birdies are collected
+        self.background = self.make_background_model(background, self.COLLECTION_THRESHOLD)
+        self.hit_background: BackgroundModel = None
+
+        if calibration is not None and calibration.has_court():
+            print("court object loaded from the calibration store")
+            self.court_z = calibration.court_z
+            self.court.plane = calibration.plane
+            self.lock_court(calibration.court_corners.tolist())
+        if calibration is None:
+            self.save_calibration()
+
+        ### start the viewer (headless mode does no drawing or GUI work at all)
+        if not headless:
+            self.viewer = Viewer(self.VIEWER_MAX_FPS)
+            self.viewer.start()
+
+        ### start the vision workers, the acquisition thread copies every frame into their shared memory
+        if vision_workers > 0:
+            # The shared memory slots hold the largest frame of all profiles, so switching profiles keeps the pool
+            max_pixels = max([width * height for width, height, fps in self.profile_modes.values()] + [self.image_size[0] * self.image_size[1]])
+            config = {
+                "downscale": self.BACKGROUND_DOWNSCALE,
+                "learning_rate": self.BACKGROUND_LEARNING_RATE,
+                "depth_scale": self.depth_scale,
+                **self.blob_config,
+            }
+            self.vision_pool = VisionPool(max_pixels, self.VISION_RING_SLOTS, vision_workers, config)
+            self.vision_pool.submit("collection_background", 0, image=background, threshold=self.COLLECTION_THRESHOLD)
+            threaded_capture = True
+
+        ### start the acquisition thread
+        if threaded_capture:
+            buffer_size = self.VISION_RING_SLOTS if self.vision_pool is not None else self.FRAME_BUFFER_SIZE
+            publish = self.vision_pool.publish if self.vision_pool is not None else None
+            is_finished = self.playback_finished if self.is_playback else None
+            self.frame_grabber = FrameGrabber(lambda: self.capture_frame(keep=True), buffer_size, publish, is_finished)
+            self.frame_grabber.start()
 
     # This function captures a frame
-    def capture_frame(self):
+    # keep has to be set if the frame is held longer than the next wait_for_frames call (e.g. in the ring buffer)
+    # The intrinsics are cached per stream profile (see apply_stream_profile), they are not queried per frame
+    def capture_frame(self, keep=False):
         frames = self.pipeline.wait_for_frames()
+        if len(self.depth_filters) > 0:
+            frames = apply_depth_filters(self.depth_filters, frames)
+        if self.align is not None:
+            frames = self.align.process(frames)
+        if keep:
+            frames.keep()
         depth_frame = frames.get_depth_frame()
         color_frame = frames.get_color_frame()
-        self.depth_intrinsics = depth_frame.profile.as_video_stream_profile().intrinsics
         if not depth_frame or not color_frame:
             return
+        self.frame_times.append(time.time())
         color_image = np.asanyarray(color_frame.get_data())
         return depth_frame, color_image
 
+    # This function checks if the playback reached the end of the recording
+    def playback_finished(self):
+        playback = self.pipeline.get_active_profile().get_device().as_playback()
+        return playback.current_status() == rs.playback_status.stopped
+
+    def enable_streams(self, mode):
+        width, height, fps = mode
+        self.config.enable_stream(rs.stream.depth, width, height, rs.format.z16, fps)
+        self.config.enable_stream(rs.stream.color, width, height, rs.format.bgr8, fps)
+
+    # This function adapts everything that depends on the stream resolution to the started pipeline profile
+    def apply_stream_profile(self, pipeline_profile):
+        depth_profile = pipeline_profile.get_stream(rs.stream.depth).as_video_stream_profile()
+        color_profile = pipeline_profile.get_stream(rs.stream.color).as_video_stream_profile()
+        # Aligned depth frames carry the color stream intrinsics
+        self.depth_intrinsics = self.stream_intrinsics(color_profile if self.align is not None else depth_profile)
+        self.image_size = (color_profile.width(), color_profile.height())
+        self.stream_mode = (color_profile.width(), color_profile.height(), color_profile.fps())
+        self.frame_times.clear()
+        self.select_depth_filters()
+        self.scale_pixel_sizes()
+        # The robot window of the previous resolution is meaningless
+        self.robot_pixel = None
+        if self.court.plane is not None:
+            self.court.plane = self.court.plane.for_intrinsics(self.depth_intrinsics)
+            if self.court.roi is not None:
+                self.court.compute_roi(*self.image_size, self.roi_margin)
+            if self.court.is_locked:
+                self.update_height_map()
+
+    # This function scales the pixel sizes tuned at REFERENCE_WIDTH (lengths linearly, areas quadratically) to the
+    # current image size and rebuilds the blob detection with them, in the vision workers as well
+    def scale_pixel_sizes(self):
+        linear = self.image_size[0] / self.REFERENCE_WIDTH
+        self.roi_margin = int(round(self.ROI_MARGIN * linear))
+        self.aruco_window_min = self.ARUCO_WINDOW_MIN * linear
+        self.blob_config = {
+            "min_area": self.minAreaThreshold * linear ** 2,
+            "max_area": self.maxAreaThreshold * linear ** 2,
+            "open_size": max(int(round(self.BLOB_OPEN_SIZE * linear)), 1),
+            "close_size": max(int(round(self.BLOB_CLOSE_SIZE * linear)), 1),
+            "depth_radius": max(int(round(self.DEPTH_SAMPLE_RADIUS * linear)), 1),
+        }
+        self.blob_detector = make_blob_detector(self.blob_config, self.BACKGROUND_DOWNSCALE)
+        if self.vision_pool is not None:
+            self.vision_pool.submit("blob_config", 0, **self.blob_config)
+
+    # This function builds the depth filter chain of the current profile (new filters, the temporal filter must not
+    # blend frames of another resolution). Playback uses the collection filters.
+    def select_depth_filters(self):
+        if not self.depth_filtering:
+            return
+        self.depth_filters = make_depth_filters(self.DEPTH_FILTERS[self.profile_name or "collection"], aligned=self.align is not None)
+
+    # This function computes the floor heights of the depth pixels for the locked court at the current resolution
+    def update_height_map(self):
+        self.height_map = FloorHeightMap(self.court.plane, *self.image_size, percentile=self.HEIGHT_PERCENTILE)
+
+    def stream_intrinsics(self, video_profile):
+        key = (video_profile.stream_type(), video_profile.width(), video_profile.height(), video_profile.fps())
+        if key not in self.intrinsics_cache:
+            self.intrinsics_cache[key] = video_profile.get_intrinsics()
+        return self.intrinsics_cache[key]
+
+    # This function switches the camera to another sensor profile (see SENSOR_PROFILES).
+    # Only the streams are restarted: the device, the sensor options (exposure) and the acquisition thread are kept.
+    # Recordings and playback keep the streams they started with.
+    def select_profile(self, name):
+        if name == self.profile_name:
+            return
+        if self.is_playback or self.is_recording:
+            print(f"Sensor profile {name} ignored, the streams of a recording cannot change")
+            return
+
+        start = time.time()
+        if self.frame_grabber is not None:
+            self.frame_grabber.pause()
+        self.pipeline.stop()
+        self.config.disable_all_streams()
+        self.enable_streams(self.profile_modes[name])
+        self.profile_name = name
+        self.apply_stream_profile(self.pipeline.start(self.config))
+        for i in range(self.PROFILE_SETTLE_FRAMES):
+            self.pipeline.wait_for_frames()
+        self.frame = None # the frames of the previous streams are not handed out anymore
+        if self.frame_grabber is not None:
+            self.frame_grabber.resume()
+        width, height, fps = self.profile_modes[name]
+        print(f"Sensor profile {name}: {width}x{height} @ {fps} fps, switched in {(time.time() - start) * 1000:.0f} ms")
+
+    # This function returns the frame rate the camera actually delivered over the last FPS_WINDOW frames
+    def delivered_fps(self):
+        frame_times = list(self.frame_times)
+        if len(frame_times) < 2 or frame_times[-1] == frame_times[0]:
+            return 0.0
+        return (len(frame_times) - 1) / (frame_times[-1] - frame_times[0])
+
+    # This function captures one frameset and publishes it on the frame bus
+    # It blocks until there is a frame, so it never returns None
+    def next_frame(self):
+        if self.frame_grabber is not None:
+            # Wait for the acquisition thread instead of reading the pipeline concurrently
+            last_seq = self.frame.seq if self.frame is not None else 0
+            while True:
+                self.frame = self.frame_grabber.wait_for_frame(last_seq) or self.frame
+                if self.frame_grabber.finished.is_set() and (self.frame is None or self.frame.seq == last_seq):
+                    # Same error the pipeline raises without the acquisition thread
+                    raise RuntimeError("Playback finished")
+                # Before the first frame of a (re)started stream there is no frame to fall back to, keep waiting
+                if self.frame is not None:
+                    return self.frame
+
+        captured = self.capture_frame()
+        while captured is None:
+            if self.frame is not None:
+                return self.frame
+            captured = self.capture_frame()
+        depth_frame, color_image = captured
+        self.frame_seq += 1
+        self.frame = Frame(self.frame_seq, depth_frame, color_image)
+        return self.frame
+
+    # This function returns the frame a consumer should work on.
+    # All consumers share the current frame, a new one is only captured once a consumer
+    # asks again for a frame it already processed (i.e. at the start of the next tick).
+    # This way every loop iteration waits for exactly one frameset.
+    # With threaded capture the newest buffered frame is returned without blocking, which
+    # may be a frame the consumer already processed (check frame.seq against last_seq).
+    def frame_for(self, last_seq):
+        if self.frame_grabber is not None:
+            latest = self.frame_grabber.latest_frame()
+            if latest is None or (latest.seq == last_seq and self.frame_grabber.finished.is_set()):
+                return self.next_frame()
+            self.frame = latest
+            return self.frame
+        if self.frame is None or self.frame.seq == last_seq:
+            return self.next_frame()
+        return self.frame
+
+    # This function returns the frames a consumer has not processed yet (oldest first).
+    # Without threaded capture this is the frame of the current tick (see frame_for).
+    def new_frames(self, last_seq):
+        frames = self.frames_since(last_seq) if self.frame_grabber is not None else []
+        if len(frames) == 0:
+            frame = self.frame_for(last_seq)
+            frames = [frame] if frame.seq != last_seq else []
+        return frames
+
+    # This function returns the newest frame without blocking
+    def latest_frame(self):
+        if self.frame_grabber is not None:
+            return self.frame_grabber.latest_frame()
+        return self.frame
+
+    # This function returns all buffered frames newer than seq (oldest first)
+    def frames_since(self, seq):
+        if self.frame_grabber is not None:
+            return self.frame_grabber.frames_since(seq)
+        return [self.frame] if self.frame is not None and self.frame.seq > seq else []
+
+    # This function stops the acquisition thread and the camera stream
+    # The adapted collection background is stored, so the next start begins with the current lighting
+    def stop(self):
+        if self.frame_grabber is not None:
+            self.frame_grabber.stop()
+            self.frame_grabber = None
+        if self.viewer is not None:
+            self.viewer.stop()
+            self.viewer = None
+        self.save_calibration()
+        if self.vision_pool is not None:
+            self.vision_pool.stop()
+            self.vision_pool = None
+        self.pipeline.stop()
+
+    # This function stores the calibration (the adapted collection background and the locked court) for the next start.
+    # It is stored for the stream the server started with, a replay does not change it.
+    def save_calibration(self):
+        if self.is_playback:
+            return
+        # The collection background adapts in the worker if there is a vision pool
+        background = self.vision_pool.collection_background_image() if self.vision_pool is not None else self.background.image()
+        calibration = Calibration(self.camera_serial, self.calibration_mode, intrinsics_tuple(self.calibration_intrinsics), self.camera_space, background)
+        if self.court.is_locked:
+            # order must match initialization order in CourtLocation class
+            corners = [self.court.CL, self.court.CR, self.court.STL, self.court.STM, self.court.STR, self.court.SBR, self.court.SBM, self.court.SBL]
+            calibration.court_corners = [corner.get_pos() for corner in corners]
+            calibration.court_z = self.court_z
+            calibration.plane = self.court.plane.for_intrinsics(self.calibration_intrinsics)
+        self.calibration_store.save(calibration)
+        print(f"calibration saved to {self.CalibrationFilePath}")
+
+    # This function loads the background image of a calibration before the calibration store, or captures a new one
+    def load_background_image(self):
+        if os.path.exists(self.BackgroundFilePath):
+            background = cv2.imread(self.BackgroundFilePath)
+            background = cv2.cvtColor(background, cv2.COLOR_BGR2GRAY)
+            if background.shape[::-1] == self.image_size:
+                return background
+            print("background image has another resolution than the camera stream, it is captured again")
+        frames = self.pipeline.wait_for_frames()
+        color_frame = frames.get_color_frame()
+        background = np.asanyarray(color_frame.get_data())
+        return cv2.cvtColor(background, cv2.COLOR_BGR2GRAY)
+
+    # This function sets the court corners (court coordinates) for the court plane and locks the court
+    def lock_court(self, court_corners):
+        self.court.set_corners(court_corners=court_corners)
+        self.court.compute_roi(*self.image_size, self.roi_margin)
+        self.court.is_locked = True
+        self.update_height_map()
+
     # This function captures the second background frame after a birdie hit
+    # The hit background model only covers the region birdies are searched in
     def capture_hit_background(self):
-        _, background = self.capture_frame()
-        self.hit_background = cv2.cvtColor(background, cv2.COLOR_BGR2GRAY)
+        if self.vision_pool is not None:
+            # The newest frame is still in the shared memory, the worker builds the model from it
+            frame = self.latest_frame() or self.next_frame()
+            self.vision_pool.submit("hit_background", frame.seq, roi=self.hit_region(frame.color_image.shape), threshold=self.HIT_THRESHOLD)
+            self.last_hitbirdie_seq = frame.seq # results of older frames belong to the previous background
+            return
+        frame = self.frame if self.frame is not None else self.next_frame()
+        x0, y0, x1, y1 = self.hit_region(frame.color_image.shape)
+        gray_frame = cv2.cvtColor(frame.color_image[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+        self.hit_background = self.make_background_model(gray_frame, self.HIT_THRESHOLD)
+
+    def make_background_model(self, gray_image, threshold):
+        return BackgroundModel(gray_image, threshold, self.BACKGROUND_DOWNSCALE, self.BACKGROUND_LEARNING_RATE)
+
+    # Restrict all hit image work to the court region (whole image as long as the court is unknown)
+    def hit_region(self, image_shape):
+        if self.court.roi is not None:
+            return self.court.roi
+        return (0, 0, image_shape[1], image_shape[0])
 
     # This function detects aruco markers (court and robot)
-    def detect_arucos(self, image=None):
-        if image is not None:
-            depth_frame, color_image = image
-        else:
-            depth_frame, color_image = self.capture_frame()
+    def detect_arucos(self, frame: Frame = None):
+        if frame is None and self.vision_pool is not None:
+            frame, result = self.pool_result(VisionPool.ARUCO, self.last_aruco_seq,
+                                             lambda latest: {"window": self.aruco_search_window(latest.color_image.shape)})
+            if frame is None:
+                return
+            aruco_corners, aruco_ids, window = result
+            self.apply_arucos(frame, aruco_corners, aruco_ids, window)
+            return
+
+        if frame is None:
+            frame = self.frame_for(self.last_aruco_seq)
+            if frame.seq == self.last_aruco_seq:
+                return
+
         # Detect aruco markers
-        aruco_corners, aruco_ids, rejected = self.arucoDetector.detectMarkers(color_image)
+        # Once the court is locked only the robot marker moves: search a window around its last position
+        # and fall back to the full frame every ARUCO_FULL_SEARCH_INTERVAL frames or when the robot got lost
+        window = self.aruco_search_window(frame.color_image.shape)
+        aruco_corners, aruco_ids = detect_markers(self.arucoDetector, frame.color_image, window)
+        self.apply_arucos(frame, aruco_corners, aruco_ids, window)
+
+    # This function updates the court and robot from the aruco markers detected in frame (searched in window, None for the full frame)
+    def apply_arucos(self, frame: Frame, aruco_corners, aruco_ids, window):
+        self.last_aruco_seq = frame.seq
+        depth_frame = frame.depth_frame
+        if window is not None:
+            self.frames_since_full_aruco_search += 1
+        else:
+            self.frames_since_full_aruco_search = 0
+        frame.arucos = (aruco_corners, aruco_ids)
 
         # Set the current visibility status for both of the arucos
         if aruco_ids is not None and len(aruco_ids) > 0:
-            if any(aruco_id[0] == self.courtArucoId for aruco_id in aruco_ids):
-                self.courtArucoVisible = True
-                self.courtArucoHasBeenFound = True
-            else:
-                self.courtArucoVisible = False
+            # The court aruco can only be seen by a full frame search
+            if window is None:
+                if any(aruco_id[0] == self.courtArucoId for aruco_id in aruco_ids):
+                    self.courtArucoVisible = True
+                    self.courtArucoHasBeenFound = True
+                else:
+                    self.courtArucoVisible = False
             if any(aruco_id[0] == self.robotArucoId for aruco_id in aruco_ids):
                 self.robotArucoVisible = True
             else:
                 self.robotArucoVisible = False
         else:
-            self.courtArucoVisible = False
+            if window is None:
+                self.courtArucoVisible = False
             self.robotArucoVisible = False
 
+        if not self.robotArucoVisible:
+            # Search the full frame on the next tick
+            self.robot_pixel = None
+
         for i, cornerSet in enumerate(aruco_corners):
             assert(cornerSet.shape[0] == 1)
             cornerSet = cornerSet[0, ...]
@@ -154,43 +589,79 @@ class RealsenseServer:
             centerSS = [(cornerA_x + cornerB_x) / 2.0, (cornerA_y + cornerB_y) / 2]
             centerZ = depth_frame.get_distance(centerSS[0], centerSS[1])
 
-            centerRS = rs.rs2_deproject_pixel_to_point(self.depth_intrinsics, centerSS, centerZ)
-            centerRS = [centerSS[0], centerSS[1], centerZ]
+            centerRS = deproject_pixels(centerSS, [centerZ], self.depth_intrinsics)[0]
 
             id = aruco_ids[i][0]
 
             if centerZ != 0:
                 # Match the aruco marker to the robot or the court
                 if id == self.robotArucoId:
-                    bottom_left = cornerSet[3]
-                    top_left = cornerSet[0]
-                    bottom_left = cornerSet[3]
+                    self.robot_pixel = centerSS
+                    self.robot_marker_size = np.linalg.norm(cornerSet[1] - cornerSet[0])
+                    if self.court.plane is None:
+                        continue # the robot can only be placed on a known court
+
+                    x, y, z = self.court.plane.camera_to_court(centerRS)[0]
+                    # The marker edge is projected onto the floor, its direction does not depend on the robot height
+                    top_left, bottom_left = self.court.plane.pixels_to_court(cornerSet[[0, 3]])
                     theta = self.aruco_angle(top_left, bottom_left) # TODO Validate if this is the correct angle
                     if self.robot is None:
-                        self.robot = RobotLocation(*centerRS, theta)
+                        self.robot = RobotLocation(x, y, z, theta)
                     else:
-                        self.robot.update(*centerRS, theta)
+                        self.robot.update(x, y, z, theta)
+                    # The filtered pose replaces the raw marker pose
+                    self.pose_filter.correct(frame.timestamp, x, y, theta)
+                    self.update_robot_pose(frame.timestamp)
                 elif id == self.courtArucoId:
                     if not self.court.is_locked:
                         if centerZ == 0:
                             raise Exception("Depth value for Court Aruco == 0 => Place court further towards the center of the boundary")
                         self.court_z = centerZ
-
-                        self.court.set_corners(aruco_corners = cornerSet)
+                        self.calibrate_court(cornerSet, depth_frame)
                 else:
                     print("Unidentified aruco marker at: ", centerRS)
 
+    # This function fits the floor plane around the court aruco and sets the court corners in court coordinates
+    def calibrate_court(self, aruco_corners, depth_frame):
+        depth_image = np.asanyarray(depth_frame.get_data())
+        height, width = depth_image.shape[:2]
+        pixel_corners = np.array([(corner.x, corner.y) for corner in self.court.calculate_court_corners(aruco_corners)])
+        x0, y0 = np.clip(pixel_corners.min(axis=0), 0, (width, height)).astype(int)
+        x1, y1 = np.clip(pixel_corners.max(axis=0), 0, (width, height)).astype(int)
+
+        plane = CourtPlane.fit(depth_image, self.depth_scale, self.depth_intrinsics, aruco_corners, (x0, y0, x1, y1))
+        if plane is not None:
+            self.court.calibrate(aruco_corners, plane)
+
+    # This function maps a pixel on the floor to court coordinates
+    def pixel_to_court(self, x, y):
+        court_x, court_y = self.court.plane.pixels_to_court([(x, y)])[0]
+        return Position(court_x, court_y, 0)
+
+    # This function returns the court coordinate box (lowx, lowy, highx, highy) of the floor that is seen at least margin pixels
+    # away from the image border
+    def vision_border(self, margin):
+        width, height = self.image_size
+        corners = self.court.plane.pixels_to_court([(margin, margin), (width - margin, margin),
+                                                    (width - margin, height - margin), (margin, height - margin)])
+        # The image border is not axis aligned on the floor, keep the box that lies inside of it
+        xs, ys = np.sort(corners[:, 0]), np.sort(corners[:, 1])
+        return (xs[1], ys[1], xs[2], ys[2])
+
+    # This function predicts the robot pose up to now (between frames and while the marker is not detected)
+    def update_robot_pose(self, now=None):
+        if self.robot is None or not self.pose_filter.is_initialized():
+            return self.robot
+        x, y, theta = self.pose_filter.predicted_pose(time.time() if now is None else now)
+        self.robot.update(x, y, self.robot.z, theta)
+        return self.robot
+
     # This function checks, if both aruco markers (robot, court) are detected
     def found_arucos(self):
         return self.robot is not None and self.court is not None
 
     def contours_are_static(self):
-        current_contours = sorted(self.contour_history[-1])
-        if len(self.contour_history) > 10:
-            prev_contours = sorted(self.contour_history[-10])
-            return len(current_contours) == len(prev_contours) and np.allclose(current_contours, prev_contours, atol=0.005, rtol=0)
-        else:
-            return False
+        return self.motion_detector.is_static()
 
 
     # This function detects aruco markers and birdies and store stheir positions
@@ -202,313 +673,157 @@ class RealsenseServer:
         #     self.capture_hit_background()
 
         # ==== FRAME QUERYING ====
-        depth_frame, color_image = self.capture_frame()
-
-
-        # ==== MARKER TRACKING ====
-        aruco_corners, aruco_ids, rejected = self.arucoDetector.detectMarkers(color_image)
-
-        # ==== BIRDIE TRACKING ====
-        ### information ###
-        # x is the width value. Center of camera is 0 width right going positiv
-        # y is the height value. Center of camera is 0 width downwards going positiv
-        # z is the deph value starting at 0 with increasing value with higher distance
-        ### information ###
-        # Convert current frame to grayscale
-        gray_frame = cv2.cvtColor(color_image, cv2.COLOR_BGR2GRAY)
-
-        # Subtract background
-        diff = cv2.absdiff(self.hit_background, gray_frame)
-
-        # Threshold to create a binary mask
-        _, mask = cv2.threshold(diff, 45, 255, cv2.THRESH_BINARY)
-        #threshhold, mask = cv2.threshold(diff, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
-
-        # Apply morphological operations to clean the mask
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-
-        # Apply morphological closing to merge nearby contours
-        # This kernelsize was chosen to merge the head and the feathers of the birdie into one object
-        kernel2 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (10, 10))
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel2)
-
-        viable_contours = []
-
-        # Find contours of the birdies
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        for contour in contours:
-            contourArea = cv2.contourArea(contour)
-            if contourArea > self.minAreaThreshold and contourArea < self.maxAreaThreshold:  # Filter small blobs
-
-                x, y, w, h = cv2.boundingRect(contour)
-                centerSS = (int(x + w/2), int(y + h/2))
-                centerZ = depth_frame.get_distance(centerSS[0], centerSS[1])
-                centerRS = rs.rs2_deproject_pixel_to_point(self.depth_intrinsics, centerSS, centerZ)
-                # TODO CHECK
-                centerRS = [centerSS[0], centerSS[1], centerZ]
-                viable_contours.append(centerRS)
-
-                if self.tracked_hitbirdie:
-                    # Update existing birdie
-                    self.tracked_hitbirdie.update(*centerRS, (x,y,w,h), contour, self.court_z)
-                else:
-                    print("Create a new Birdie")
-                    # Create new birdie
-                    self.tracked_hitbirdie = Birdie(*centerRS, False, (x, y, w, h), contour)
-
-        self.contour_history.append(viable_contours)
-
-        # ==== Visualize ==== #
-        if visualize:
-
-            # Drawing params
-            fontScale = 2.3
-            fontFace = cv2.FONT_HERSHEY_PLAIN
-            fontColor = (0, 255, 0)
-            fontThickness = 2
-            length = 50
-
-            birdie = self.tracked_hitbirdie
-            if birdie:
-                x, y, w, h = birdie.bounding_rect
-                bx, by, bz = int(birdie.x), int(birdie.y), int(birdie.z)
-                # cv2.putText(color_image, f"ID: {birdie.id}",(x, y - 10), fontFace, fontScale, fontColor, fontThickness, cv2.LINE_AA)
-                # TODO Before (birdie.x, birdie.y) was CenterSS !!Validate if it works)
-                cv2.putText(color_image, str(round(bz, 2)), (bx, by), fontFace, fontScale, fontColor, fontThickness, cv2.LINE_AA)
-                cv2.rectangle(color_image, (x, y), (x + w, y + h), (0, 255, 0), 2)
-                if birdie.impact_position:
-                    ip = birdie.impact_position
-                    cv2.rectangle(color_image, (ip.x - 3, ip.y -3), (ip.x + 3, ip.y + 3),  (0, 255, 0), 2)
-
-            # TODO Validate result
-
-            #end_x = int(bx + length * np.cos(np.radians(birdie.angle)))
-            #end_y = int(by+ length * np.sin(np.radians(birdie.angle)))
-            #cv2.line(color_image, (bx, by), (end_x, end_y), (255, 0, 0), 2)
-            #if self.CurrentTime % 20 == 0:
-                #print("Birdie", birdie.id, bx, birdie.x, by, birdie.y)
-                #print(x,y)
-
-
-        ### BADMINTON COURT VISUALIZATION
-        if self.court:
-            #court_corners = [self.court.CL, self.court.CR, self.court.STL, self.court.STM, self.court.STR, self.court.SBR, self.court.SBM, self.court.SBL]
-            #labels = ['CL', 'CR', 'STL', 'STM', 'STR', 'SBR', 'SBM', 'SBL']
-
-            # Define connections for the court and serving box
-            court_connections = [(self.court.CL, self.court.CR)]  # Only one line for court boundary
-            serve_box_connections = [
-                (self.court.STL, self.court.STM),  # Top of the serving box
-                (self.court.STM, self.court.STR),
-                (self.court.STR, self.court.SBR),  # Right side
-                (self.court.SBR, self.court.SBM),  # Bottom of the serving box
-                (self.court.SBM, self.court.SBL),
-                (self.court.SBL, self.court.STL),  # Left side
-                (self.court.SBM, self.court.STM)
-            ]
-
-            # Draw court boundary lines
-            for corner1, corner2 in court_connections:
-                cv2.line(color_image,
-                        (int(corner1.x), int(corner1.y)),
-                        (int(corner2.x), int(corner2.y)),
-                        (255, 0, 0), 2)  # Blue for court boundary
-
-            # Draw serving box lines
-            for corner1, corner2 in serve_box_connections:
-                cv2.line(color_image,
-                        (int(corner1.x), int(corner1.y)),
-                        (int(corner2.x), int(corner2.y)),
-                        (0, 0, 255), 2)  # Red for serving box
-
-            # Annotate the corners
-            labels = ['CL', 'CR', 'STL', 'STM', 'STR', 'SBR', 'SBM', 'SBL']
-            court_corners = [self.court.CL, self.court.CR, self.court.STL, self.court.STM, self.court.STR, self.court.SBR, self.court.SBM, self.court.SBL]
-            for i, corner in enumerate(court_corners):
-                cv2.circle(color_image, center=(int(corner.x), int(corner.y)), radius=5, color=(0, 255, 0), thickness=-1)
-                cv2.putText(color_image, labels[i], (int(corner.x) + 10, int(corner.y) + 10), fontFace, (fontScale * 0.4), (0, 255, 0), fontThickness, cv2.LINE_AA)
-
-
-        ### ARUCO MARKER VISUALIZATION ###
-        # Draw aruco markers for robot and field court
-        color_image = cv2.aruco.drawDetectedMarkers(color_image,aruco_corners,aruco_ids)
-        depth_image = np.asanyarray(depth_frame.get_data())
-        depth_colormap = cv2.applyColorMap(cv2.convertScaleAbs(depth_image, alpha=0.03), cv2.COLORMAP_JET)
-
-        depth_colormap_dim = depth_colormap.shape
-        color_colormap_dim = color_image.shape
-
-        # If depth and color resolutions are different, resize color image to match depth image for display
-        if depth_colormap_dim != color_colormap_dim:
-            resized_color_image = cv2.resize(color_image, dsize=(depth_colormap_dim[1], depth_colormap_dim[0]), interpolation=cv2.INTER_AREA)
-            images = np.hstack((resized_color_image, depth_colormap))
+        if self.vision_pool is not None:
+            # The worker subtracts the background, finds the blobs and samples their depth, the tracking stays here
+            visualize = visualize and self.viewer is not None
+            frame, result = self.pool_result(VisionPool.HIT, self.last_hitbirdie_seq, lambda latest: self.hit_job(latest, visualize))
+            if frame is None:
+                return
+            self.last_hitbirdie_seq = frame.seq
+            contours, rects, centers, depths, mask = result
+            blobs = self.place_blobs(contours, rects, centers, depths, np.asanyarray(frame.depth_frame.get_data()))
+            self.track_hitbirdies(frame, blobs)
         else:
-            images = np.hstack((color_image, depth_colormap))
-
+            # Every new frame is tracked in order: when the camera runs faster than the control loop several frames
+            # arrive per tick, and a skipped frame would be a gap in the track of the flying birdie
+            frames = self.new_frames(self.last_hitbirdie_seq)
+            if len(frames) == 0:
+                # Nothing new from the acquisition thread yet
+                return
+            for frame in frames:
+                self.last_hitbirdie_seq = frame.seq
+
+                # ==== BIRDIE TRACKING ====
+                ### information ###
+                # x is the width value. Center of camera is 0 width right going positiv
+                # y is the height value. Center of camera is 0 width downwards going positiv
+                # z is the deph value starting at 0 with increasing value with higher distance
+                ### information ###
+                # Restrict all image work to the court region
+                x0, y0, x1, y1 = self.hit_region(frame.color_image.shape)
+
+                # Convert current frame to grayscale
+                gray_frame = cv2.cvtColor(frame.color_image[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+
+                # Subtract background, clean the mask (opening, then closing to merge the head and the feathers of the birdie)
+                # and find the contours of the birdies: coarse on the downscaled mask, refined at full resolution around the candidates
+                contours, mask = self.blob_detector.detect(self.hit_background, gray_frame, offset=(x0, y0))
+                #threshhold, mask = cv2.threshold(diff, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+                blobs = self.locate_blobs(contours, frame.depth_frame)
+                self.track_hitbirdies(frame, blobs)
+
+                # Learn the background everywhere except at the foreground and the tracked birdies
+                self.hit_background.update(exclude_rects=self.tracked_rects((x0, y0)))
+        depth_frame, color_image = frame.depth_frame, frame.color_image
 
-
-        cv2.namedWindow('RealSense', cv2.WINDOW_AUTOSIZE)
-        cv2.imshow('RealSense', images)
-        cv2.imshow("Mask", mask)
-        cv2.waitKey(1)
-
-        # ==== DEBUG END ====
-
-        # self.CurrentTime += 1
+        # ==== Visualize ==== #
+        # No drawing happens here, the viewer draws the published results on its own thread
+        if visualize and self.viewer is not None:
+            birdies = self.birdie_tracker.birdies()
+            depth_image = np.asanyarray(depth_frame.get_data())
+            self.viewer.publish('RealSense', draw_hit_view, color_image, depth_image, self.court, birdies, frame.arucos)
+            self.viewer.publish('Mask', draw_mask, mask)
+
+    # This function assigns the blobs found in frame to the birdie tracks
+    def track_hitbirdies(self, frame: Frame, blobs):
+        detections = []
+        for contour, bounding_rect, centerSS, centerZ, point, court_point in blobs:
+            detections.append((court_point, bounding_rect, contour, point))
+
+        self.birdie_tracker.update(detections, self.GROUND_HEIGHT, frame.timestamp)
+        self.motion_detector.update(self.birdie_tracker.birdies())
 
     # This function detects birdies at collection time
-    def detect_collection_birdies(self, visualize = False):
+    # With mask_robot the robot footprint is excluded, so birdies can be detected while the robot is on court
+    # Without wait None is returned if there is no new frame yet (instead of blocking until there is one)
+    def detect_collection_birdies(self, visualize = False, mask_robot = True, wait = True):
+        # The robot is not part of the background, remove it (and the birdie it is collecting) from the mask
+        robot_polygons = []
+        if self.robot is not None and self.court.plane is not None:
+            robot_polygons.append(self.robot_mask_polygon())
+
         # ==== FRAME QUERYING ====
-        depth_frame, color_image = self.capture_frame()
-
-        ### --- Birdie Tracking Code --- ###
-        ### information ###
-        # x is the width value. Center of camera is 0 width right going positiv
-        # y is the height value. Center of camera is 0 width downwards going positiv
-        ### information ###
-        # Convert current frame to grayscale
-        gray_frame = cv2.cvtColor(color_image, cv2.COLOR_BGR2GRAY)
-
-        # Subtract background
-        diff = cv2.absdiff(self.background, gray_frame)
-
-        # Threshold to create a binary mask
-        _, mask = cv2.threshold(diff, 100, 255, cv2.THRESH_BINARY)
-        #threshhold, mask = cv2.threshold(diff, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
-        #print(threshhold)
-        # Apply morphological operations to clean the mask
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-
-        # Apply morphological closing to merge nearby contours
-        # This kernelsize was chosen to merge the head and the feathers of the birdie into one object
-        kernel2 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (10, 10))
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel2)
-
-        # Find contours of the birdies
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if self.vision_pool is not None:
+            # The caller needs the birdies of a new frame, so wait for the worker (if it waits)
+            visualize = visualize and self.viewer is not None
+            params = {"exclude_polygons": robot_polygons if mask_robot else [], "robot_polygons": robot_polygons, "visualize": visualize}
+            frame, result = self.pool_result(VisionPool.COLLECTION, self.last_collection_seq, lambda latest: params, wait=wait)
+            if frame is None:
+                return None
+            self.last_collection_seq = frame.seq
+            contours, rects, centers, depths, mask = result
+            blobs = self.place_blobs(contours, rects, centers, depths, np.asanyarray(frame.depth_frame.get_data()))
+        else:
+            frame = self.frame_for(self.last_collection_seq)
+            if frame.seq == self.last_collection_seq:
+                if not wait:
+                    return None
+                frame = self.next_frame()
+            self.last_collection_seq = frame.seq
+
+            ### --- Birdie Tracking Code --- ###
+            ### information ###
+            # x is the width value. Center of camera is 0 width right going positiv
+            # y is the height value. Center of camera is 0 width downwards going positiv
+            ### information ###
+            # Convert current frame to grayscale
+            gray_frame = cv2.cvtColor(frame.color_image, cv2.COLOR_BGR2GRAY)
+
+            # Subtract background, clean the mask and find the contours of the birdies (coarse to fine, see detect_birdies)
+            contours, mask = self.blob_detector.detect(self.background, gray_frame, exclude_polygons=robot_polygons if mask_robot else ())
+            #threshhold, mask = cv2.threshold(diff, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+            #print(threshhold)
+            blobs = self.locate_blobs(contours, frame.depth_frame)
+        color_image = frame.color_image
 
         birdiesList = []
-        for contour in contours:
-            contourArea = cv2.contourArea(contour)
-            if contourArea > self.minAreaThreshold and contourArea < self.maxAreaThreshold:  # Filter small blobs
-                print(f"Birdie, CA: {contourArea}")
+        for contour, bounding_rect, centerSS, centerZ, point, court_point in blobs:
+            newBirdie = Birdie(*court_point, False, bounding_rect, contour, timestamp=frame.timestamp)
+            newBirdie.camera_point = point
+            birdiesList.append(newBirdie)
 
-                x, y, w, h = cv2.boundingRect(contour)
-                centerSS = (int(x + w/2), int(y + h/2))
-                centerZ = depth_frame.get_distance(centerSS[0], centerSS[1])
-                centerRS = rs.rs2_deproject_pixel_to_point(self.depth_intrinsics, centerSS, centerZ)
-                centerRS = [centerSS[0], centerSS[1], centerZ]
-
-                newBirdie = Birdie(*centerRS, False, (x, y, w, h), contour)
-                birdiesList.append(newBirdie)
+        # Learn the background everywhere except at the foreground, the birdies and the robot
+        if self.vision_pool is None:
+            self.background.update(exclude_rects=[birdie.bounding_rect for birdie in birdiesList], exclude_polygons=robot_polygons)
 
         # ==== Visualize ==== #
-        if visualize:
-
-            # Drawing params
-            fontScale = 2.3
-            fontFace = cv2.FONT_HERSHEY_PLAIN
-            fontColor = (0, 255, 0)
-            fontThickness = 2
-            length = 50
-
-            for birdie in birdiesList:
-                x, y, w, h = birdie.bounding_rect
-                bx, by, bz = int(birdie.x), int(birdie.y), int(birdie.z)
-                # cv2.putText(color_image, f"ID: {birdie.id}",(x, y - 10), fontFace, fontScale, fontColor, fontThickness, cv2.LINE_AA)
-                # TODO Before (birdie.x, birdie.y) was CenterSS !!Validate if it works)
-                cv2.putText(color_image, str(round(bz, 2)), (bx, by), fontFace, fontScale, fontColor, fontThickness, cv2.LINE_AA)
-                cv2.rectangle(color_image, (x, y), (x + w, y + h), (0, 255, 0), 2)
-
-                # TODO Validate result
-
-                #end_x = int(bx + length * np.cos(np.radians(birdie.angle)))
-                #end_y = int(by+ length * np.sin(np.radians(birdie.angle)))
-                #cv2.line(color_image, (bx, by), (end_x, end_y), (255, 0, 0), 2)
-                #if self.CurrentTime % 20 == 0:
-                    #print("Birdie", birdie.id, bx, birdie.x, by, birdie.y)
-                    #print(x,y)
-
-            cv2.namedWindow('RealSense', cv2.WINDOW_AUTOSIZE)
-            cv2.imshow('RealSense', color_image)
-            cv2.imshow('Mask', mask)
-            cv2.waitKey(1)
+        if visualize and self.viewer is not None:
+            self.viewer.publish('RealSense', draw_collection_view, color_image, birdiesList)
+            self.viewer.publish('Mask', draw_mask, mask)
 
         return birdiesList
 
     def save_court_position(self):
         print("save_court_position_called")
-        if os.path.exists(self.court_pos_file_path):
+        if self.court.is_locked:
             return
 
+        found_frames = 0
         while not self.court.is_locked:
-            depth_frame, color_image = self.capture_frame()
-            self.detect_arucos(image=[depth_frame, color_image]) # This updates the court object
-            if self.courtArucoHasBeenFound == False:
+            frame = self.next_frame()
+            self.detect_arucos(frame) # This updates the court object
+            if self.courtArucoHasBeenFound == False or self.court.plane is None:
+                continue
+
+            if self.headless:
+                # Nobody can confirm the position without a window, so lock it once the court aruco was seen long enough
+                if self.courtArucoVisible:
+                    found_frames += 1
+                if found_frames >= self.HEADLESS_COURT_LOCK_FRAMES:
+                    self.court.is_locked = True
                 continue
 
-            # Define connections for the court and serving box
-            court_connections = [(self.court.CL, self.court.CR)]  # Only one line for court boundary
-            serve_box_connections = [
-                (self.court.STL, self.court.STM),  # Top of the serving box
-                (self.court.STM, self.court.STR),
-                (self.court.STR, self.court.SBR),  # Right side
-                (self.court.SBR, self.court.SBM),  # Bottom of the serving box
-                (self.court.SBM, self.court.SBL),
-                (self.court.SBL, self.court.STL),  # Left side
-                (self.court.SBM, self.court.STM)
-            ]
-
-            # Draw court boundary lines
-            for corner1, corner2 in court_connections:
-                cv2.line(color_image,
-                        (int(corner1.x), int(corner1.y)),
-                        (int(corner2.x), int(corner2.y)),
-                        (255, 0, 0), 2)  # Blue for court boundary
-
-            # Draw serving box lines
-            for corner1, corner2 in serve_box_connections:
-                cv2.line(color_image,
-                        (int(corner1.x), int(corner1.y)),
-                        (int(corner2.x), int(corner2.y)),
-                        (0, 0, 255), 2)  # Red for serving box
-
-            # Annotate the corners
-            labels = ['CL', 'CR', 'STL', 'STM', 'STR', 'SBR', 'SBM', 'SBL']
-            court_corners = [self.court.CL, self.court.CR, self.court.STL, self.court.STM, self.court.STR, self.court.SBR, self.court.SBM, self.court.SBL]
-            print(self.court.SBL)
-            fontScale = 2.3
-            fontFace = cv2.FONT_HERSHEY_PLAIN
-            fontThickness = 2
-            for i, corner in enumerate(court_corners):
-                cv2.circle(color_image, center=(int(corner.x), int(corner.y)), radius=5, color=(0, 255, 0), thickness=-1)
-                cv2.putText(color_image, labels[i], (int(corner.x) + 10, int(corner.y) + 10), fontFace, (fontScale * 0.4), (0, 255, 0), fontThickness, cv2.LINE_AA)
-
-            cv2.namedWindow('CourtOrienting', cv2.WINDOW_AUTOSIZE)
-            cv2.imshow('CourtOrienting', color_image)
+            # The viewer thread shows the window and reads the keys (HighGUI is only used on that thread)
+            self.viewer.publish('CourtOrienting', draw_court, frame.color_image.copy(), self.court)
 
             # Wait till keypress which will initiate saving court position into file
-            if cv2.waitKey(1) & 0xFF == ord('r'):
+            if ord('r') in self.viewer.read_keys():
                 self.court.is_locked = True
-                cv2.destroyAllWindows()
-
-        # order must match initialization order in CourtLocation class
-        data = {
-            "Z": self.court_z,
-            "CL": self.court.CL.get_pos(),
-            "CR": self.court.CR.get_pos(),
-            "STL": self.court.STL.get_pos(),
-            "STM": self.court.STM.get_pos(),
-            "STR": self.court.STR.get_pos(),
-            "SBR": self.court.SBR.get_pos(),
-            "SBM": self.court.SBM.get_pos(),
-            "SBL": self.court.SBL.get_pos(),
-        }
-        print(data)
-        with open(self.court_pos_file_path, "w") as file:
-            json.dump(data, file)
+                self.viewer.close('CourtOrienting')
+
+        self.court.compute_roi(*self.image_size, self.roi_margin)
+        self.update_height_map()
+        self.save_calibration()
 
         return
 
@@ -516,6 +831,104 @@ class RealsenseServer:
 
 
     # --- Helper Methods --- #
+    # This function returns the (x0, y0, x1, y1) window the aruco detection is restricted to,
+    # or None if the full frame has to be searched
+    def aruco_search_window(self, image_shape):
+        if not self.court.is_locked or self.robot_pixel is None:
+            return None
+        if self.frames_since_full_aruco_search >= self.ARUCO_FULL_SEARCH_INTERVAL:
+            return None
+
+        half_size = max(self.ARUCO_WINDOW_SCALE * self.robot_marker_size, self.aruco_window_min)
+        x0 = int(np.clip(self.robot_pixel[0] - half_size, 0, image_shape[1]))
+        y0 = int(np.clip(self.robot_pixel[1] - half_size, 0, image_shape[0]))
+        x1 = int(np.clip(self.robot_pixel[0] + half_size, 0, image_shape[1]))
+        y1 = int(np.clip(self.robot_pixel[1] + half_size, 0, image_shape[0]))
+        return (x0, y0, x1, y1)
+
+    # This function filters the contours by area and locates all remaining blobs at once:
+    # one depth image conversion, one vectorized robust depth sampling, one batched deprojection
+    # and one transformation into court coordinates per frame.
+    # Blobs without any valid depth around their center (depth dropouts) are dropped.
+    # Returns a list of (contour, bounding_rect, centerSS, centerZ, camera_point, court_point)
+    def locate_blobs(self, contours, depth_frame):
+        depth_image = np.asanyarray(depth_frame.get_data())
+        contours, rects, centers, depths = self.blob_detector.measure(contours, depth_image, self.blob_config["depth_radius"], self.depth_scale)
+        return self.place_blobs(contours, rects, centers, depths, depth_image)
+
+    # This function deprojects measured blobs (see BlobDetector.measure) and transforms them into court coordinates.
+    # With a height map the height of a blob is measured over all depth pixels of its contour instead of the center window.
+    def place_blobs(self, contours, rects, centers, depths, depth_image):
+        if len(contours) == 0:
+            return []
+        points = deproject_pixels(centers, depths, self.depth_intrinsics)
+        court_points = self.court.plane.camera_to_court(points)
+        if self.height_map is not None:
+            heights = self.height_map.blob_heights(depth_image, rects, contours, self.depth_scale)
+            measured = ~np.isnan(heights)
+            court_points[measured, 2] = heights[measured]
+
+        blobs = []
+        for contour, bounding_rect, center, depth, point, court_point in zip(contours, rects, centers, depths, points, court_points):
+            if depth == 0:
+                continue
+            blobs.append((contour, tuple(int(v) for v in bounding_rect), (int(center[0]), int(center[1])), float(depth), point, court_point))
+        return blobs
+
+    # This function returns the (x, y, w, h) rects of the tracked birdies relative to origin
+    def tracked_rects(self, origin):
+        x0, y0 = origin
+        return [(x - x0, y - y0, w, h) for x, y, w, h in (birdie.bounding_rect for birdie in self.birdie_tracker.birdies())]
+
+    # This function returns the parameters of a hit birdie job of the vision pool for the frame latest
+    def hit_job(self, latest, visualize):
+        roi = self.hit_region(latest.color_image.shape)
+        return {"roi": roi, "tracked_rects": self.tracked_rects(roi[:2]), "visualize": visualize}
+
+    # This function hands the newest frame to the vision pool (unless the task has enough jobs in flight, make_params
+    # returns the job parameters for it) and returns (frame, result) of the newest finished job of the task.
+    # Results for frames up to last_seq and results whose frame was overwritten are dropped, (None, None) is returned
+    # if there is no new result. With wait it blocks until there is one.
+    def pool_result(self, task, last_seq, make_params, wait=False):
+        pool = self.vision_pool
+        while True:
+            if not pool.busy(task):
+                latest = self.frame_grabber.latest_frame()
+                submitted_seq = pool.submitted_seq(task)
+                if self.frame_grabber.finished.is_set() and not pool.has_result(task) and (latest is None or latest.seq <= submitted_seq):
+                    raise RuntimeError("Playback finished")
+                if wait and not pool.has_result(task) and (latest is None or latest.seq <= submitted_seq):
+                    latest = self.frame_grabber.wait_for_frame(submitted_seq)
+                if latest is not None and latest.seq > submitted_seq:
+                    pool.submit(task, latest.seq, **make_params(latest))
+
+            finished = pool.take(task, wait)
+            if finished is not None:
+                seq, result = finished
+                frame = self.frame_grabber.frame(seq)
+                if result is not None and frame is not None and seq > last_seq:
+                    self.frame = frame
+                    return frame, result
+            if not wait:
+                return None, None
+
+    # This function returns the convex pixel polygon the robot covers in the image: its footprint (plus margin)
+    # seen at the floor and at the height of its marker
+    def robot_mask_polygon(self):
+        footprint = self.robot.footprint(self.ROBOT_MASK_MARGIN)
+        floor = np.column_stack((footprint, np.zeros(len(footprint))))
+        top = np.column_stack((footprint, np.full(len(footprint), max(self.robot.z, 0))))
+        pixels = self.court.plane.court_to_pixels(np.vstack((floor, top)))
+        return cv2.convexHull(np.round(pixels).astype(np.int32))
+
+    # This function checks if a court position on the floor is hidden by the robot in the image (inside robot_mask_polygon),
+    # a birdie there can not be detected
+    def occluded_by_robot(self, position):
+        if self.robot is None or self.court.plane is None:
+            return False
+        pixel = self.court.plane.court_to_pixels([(position.x, position.y, 0)])[0]
+        return cv2.pointPolygonTest(self.robot_mask_polygon(), (float(pixel[0]), float(pixel[1])), False) >= 0
+
     # Find theta angle (angle on y-axis between top left and bottom left corner)
     def aruco_angle(self, corner_top_left, corner_bottom_left):
         delta_x = (corner_bottom_left[0] - corner_top_left[0])
@@ -524,6 +937,12 @@ class RealsenseServer:
 
         return theta
 
+    # The oldest birdie that is still tracked (for code that only follows a single birdie)
+    @property
+    def tracked_hitbirdie(self):
+        birdies = self.birdie_tracker.birdies()
+        return birdies[0] if len(birdies) > 0 else None
+
     def prepare_birdie_tracking(self):
-        self.tracked_hitbirdie = None
-        self.contour_history = []
\ No newline at end of file
+        self.birdie_tracker.reset()
+        self.motion_detector.reset()
\ No newline at end of file
@@ -0,0 +1,75 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+"""
+This class is a ring of depth + color frame slots in one multiprocessing shared memory block.
+
+The capture side copies every frameset once into slot seq % slots, the vision pool workers read
+the slots as NumPy views without any copy or pickling. A slot header holds the seq, timestamp and
+image sizes of the frame in it, every slot is large enough for max_pixels, so the stream profile
+can change without a new ring. The header seq is invalidated while a slot is written, so a reader
+can check with holds(seq) before and after its work whether the frame was overwritten in the meantime.
+"""
+class SharedFrameRing:
+    SEQ, TIMESTAMP, COLOR_HEIGHT, COLOR_WIDTH, DEPTH_HEIGHT, DEPTH_WIDTH = range(6)
+
+    def __init__(self, max_pixels, slots, name=None):
+        self.max_pixels = max_pixels
+        self.slots = slots
+        self.is_owner = name is None
+
+        header_bytes = slots * 6 * 8
+        color_bytes = slots * max_pixels * 3
+        depth_bytes = slots * max_pixels * 2
+        if self.is_owner:
+            self.memory = shared_memory.SharedMemory(create=True, size=header_bytes + color_bytes + depth_bytes)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+
+        buffer = self.memory.buf
+        self.header = np.ndarray((slots, 6), dtype=np.float64, buffer=buffer)
+        self.color = np.ndarray((slots, max_pixels * 3), dtype=np.uint8, buffer=buffer, offset=header_bytes)
+        self.depth = np.ndarray((slots, max_pixels), dtype=np.uint16, buffer=buffer, offset=header_bytes + color_bytes)
+        if self.is_owner:
+            self.header[:, self.SEQ] = -1
+
+    # Everything a worker process needs to attach to the ring (see attach)
+    def spec(self):
+        return (self.memory.name, self.max_pixels, self.slots)
+
+    @classmethod
+    def attach(cls, spec):
+        name, max_pixels, slots = spec
+        return cls(max_pixels, slots, name=name)
+
+    # This function copies a frameset into its slot
+    def write(self, seq, timestamp, depth_image, color_image):
+        slot = seq % self.slots
+        color_height, color_width = color_image.shape[:2]
+        depth_height, depth_width = depth_image.shape[:2]
+        self.header[slot, self.SEQ] = -1
+        self.depth[slot, :depth_image.size] = depth_image.reshape(-1)
+        self.color[slot, :color_image.size] = color_image.reshape(-1)
+        self.header[slot, self.TIMESTAMP:] = (timestamp, color_height, color_width, depth_height, depth_width)
+        self.header[slot, self.SEQ] = seq
+
+    def holds(self, seq):
+        return self.header[seq % self.slots, self.SEQ] == seq
+
+    # This function returns (depth_image, color_image) views of the frame seq, or None if its slot was overwritten
+    def read(self, seq):
+        if not self.holds(seq):
+            return None
+        slot = seq % self.slots
+        color_height, color_width, depth_height, depth_width = self.header[slot, self.COLOR_HEIGHT:].astype(int)
+        color_image = self.color[slot, :color_height * color_width * 3].reshape(color_height, color_width, 3)
+        depth_image = self.depth[slot, :depth_height * depth_width].reshape(depth_height, depth_width)
+        return depth_image, color_image
+
+    # This function detaches from the shared memory, the owner also frees it
+    def close(self):
+        # The views have to be released before the buffer can be closed
+        self.header = self.color = self.depth = None
+        self.memory.close()
+        if self.is_owner:
+            self.memory.unlink()
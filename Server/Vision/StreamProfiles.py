@@ -0,0 +1,32 @@
+import pyrealsense2 as rs
+
+"""
+Sensor profiles of the RealsenseServer.
+
+A profile is a list of candidate (width, height, fps) modes in order of preference, e.g. a low
+resolution / high frame rate mode for tracking birdies in flight and a high resolution mode for
+calibration and collection. Depth and color always run in the same mode, so pixel coordinates of
+both images match. A profile is resolved once against the modes the connected camera supports:
+the first candidate that the depth and the color sensor both offer is used.
+"""
+
+# This function returns the set of (stream, width, height, fps) modes the sensors of a device support
+# (depth in z16, color in bgr8, the formats the RealsenseServer works with)
+def supported_modes(device):
+    formats = {rs.stream.depth: rs.format.z16, rs.stream.color: rs.format.bgr8}
+    modes = set()
+    for sensor in device.query_sensors():
+        for profile in sensor.get_stream_profiles():
+            stream = profile.stream_type()
+            if formats.get(stream) != profile.format() or not profile.is_video_stream_profile():
+                continue
+            video_profile = profile.as_video_stream_profile()
+            modes.add((stream, video_profile.width(), video_profile.height(), profile.fps()))
+    return modes
+
+# This function returns the first (width, height, fps) candidate that depth and color both support, or None
+def select_mode(candidates, modes):
+    for width, height, fps in candidates:
+        if (rs.stream.depth, width, height, fps) in modes and (rs.stream.color, width, height, fps) in modes:
+            return (width, height, fps)
+    return None
@@ -0,0 +1,163 @@
+import threading
+import queue
+import time
+import numpy as np
+import cv2
+
+"""
+This class shows the detection results of the RealsenseServer in its own thread.
+
+The detection code only publishes its latest results (no drawing happens there), the viewer
+draws and shows them at most max_fps times per second. Results that arrive faster are dropped,
+so the visualization never slows down the tracking.
+All HighGUI calls (showing, closing windows and reading keys) happen on the viewer thread only,
+the keys pressed in the windows are handed out by read_keys.
+"""
+class Viewer(threading.Thread):
+
+    def __init__(self, max_fps=15):
+        super().__init__(daemon=True)
+        self.frame_period = 1.0 / max_fps
+        self.pending = {} # window name -> (draw function, args) of the latest published result
+        self.closing = set() # windows to close
+        self.windows = set() # windows that are shown
+        self.keys = queue.Queue() # keys pressed in the windows
+        self.running = False
+        self.lock = threading.Lock()
+        self.published = threading.Event()
+
+    # This function hands the latest result of a window to the viewer (replaces older unshown results)
+    def publish(self, window, draw, *args):
+        with self.lock:
+            self.pending[window] = (draw, args)
+        self.published.set()
+
+    # This function asks the viewer to close a window
+    def close(self, window):
+        with self.lock:
+            self.pending.pop(window, None)
+            self.closing.add(window)
+        self.published.set()
+
+    # This function returns the keys pressed in the windows since the last call
+    def read_keys(self):
+        keys = []
+        while not self.keys.empty():
+            keys.append(self.keys.get_nowait())
+        return keys
+
+    def run(self):
+        self.running = True
+        while self.running:
+            self.published.wait(timeout=0.5)
+            self.published.clear()
+            with self.lock:
+                pending = self.pending
+                self.pending = {}
+                closing = self.closing
+                self.closing = set()
+            for window in closing & self.windows:
+                cv2.destroyWindow(window)
+            self.windows -= closing
+            if len(pending) == 0:
+                continue
+
+            start = time.time()
+            for window, (draw, args) in pending.items():
+                cv2.namedWindow(window, cv2.WINDOW_AUTOSIZE)
+                cv2.imshow(window, draw(*args))
+                self.windows.add(window)
+            key = cv2.waitKey(1) & 0xFF
+            if key != 0xFF:
+                self.keys.put(key)
+
+            # Rate limit the drawing
+            remaining = self.frame_period - (time.time() - start)
+            if remaining > 0:
+                time.sleep(remaining)
+        cv2.destroyAllWindows()
+
+    def stop(self):
+        self.running = False
+        self.published.set()
+        self.join(timeout=1)
+
+
+# --- Drawing functions (these always draw on a copy of the image) --- #
+
+# Drawing params
+fontScale = 2.3
+fontFace = cv2.FONT_HERSHEY_PLAIN
+fontColor = (0, 255, 0)
+fontThickness = 2
+
+def draw_court(color_image, court):
+    # Nothing to draw before the court corners are known
+    if not hasattr(court, "CL") or court.plane is None:
+        return color_image
+
+    # The corners are in court coordinates, draw them at their pixel positions
+    pixels = court.pixel_corners()
+    CL, CR, STL, STM, STR, SBR, SBM, SBL = [(int(x), int(y)) for x, y in pixels]
+
+    # Define connections for the court and serving box
+    court_connections = [(CL, CR)]  # Only one line for court boundary
+    serve_box_connections = [
+        (STL, STM),  # Top of the serving box
+        (STM, STR),
+        (STR, SBR),  # Right side
+        (SBR, SBM),  # Bottom of the serving box
+        (SBM, SBL),
+        (SBL, STL),  # Left side
+        (SBM, STM)
+    ]
+
+    # Draw court boundary lines
+    for corner1, corner2 in court_connections:
+        cv2.line(color_image, corner1, corner2, (255, 0, 0), 2)  # Blue for court boundary
+
+    # Draw serving box lines
+    for corner1, corner2 in serve_box_connections:
+        cv2.line(color_image, corner1, corner2, (0, 0, 255), 2)  # Red for serving box
+
+    # Annotate the corners
+    labels = ['CL', 'CR', 'STL', 'STM', 'STR', 'SBR', 'SBM', 'SBL']
+    court_corners = [CL, CR, STL, STM, STR, SBR, SBM, SBL]
+    for i, (x, y) in enumerate(court_corners):
+        cv2.circle(color_image, center=(x, y), radius=5, color=(0, 255, 0), thickness=-1)
+        cv2.putText(color_image, labels[i], (x + 10, y + 10), fontFace, (fontScale * 0.4), (0, 255, 0), fontThickness, cv2.LINE_AA)
+
+    return color_image
+
+# Birdie positions are in court coordinates, they are drawn at their bounding rect (the height is written next to it)
+def draw_birdies(color_image, birdies, court=None):
+    for birdie in birdies:
+        x, y, w, h = birdie.bounding_rect
+        cv2.putText(color_image, str(int(birdie.z)), (x + w // 2, y + h // 2), fontFace, fontScale, fontColor, fontThickness, cv2.LINE_AA)
+        cv2.rectangle(color_image, (x, y), (x + w, y + h), (0, 255, 0), 2)
+        if getattr(birdie, "impact_position", None) and court is not None and court.plane is not None:
+            ip = court.plane.court_to_pixels([(birdie.impact_position.x, birdie.impact_position.y)])[0]
+            cv2.rectangle(color_image, (int(ip[0]) - 3, int(ip[1]) - 3), (int(ip[0]) + 3, int(ip[1]) + 3), (0, 255, 0), 2)
+
+    return color_image
+
+# Camera image with court, birdies and aruco markers next to the colorized depth image
+def draw_hit_view(color_image, depth_image, court, birdies, arucos):
+    color_image = draw_court(color_image.copy(), court)
+    color_image = draw_birdies(color_image, birdies, court)
+    if arucos is not None:
+        aruco_corners, aruco_ids = arucos
+        color_image = cv2.aruco.drawDetectedMarkers(color_image, aruco_corners, aruco_ids)
+
+    depth_colormap = cv2.applyColorMap(cv2.convertScaleAbs(depth_image, alpha=0.03), cv2.COLORMAP_JET)
+
+    # If depth and color resolutions are different, resize color image to match depth image for display
+    if depth_colormap.shape != color_image.shape:
+        color_image = cv2.resize(color_image, dsize=(depth_colormap.shape[1], depth_colormap.shape[0]), interpolation=cv2.INTER_AREA)
+    return np.hstack((color_image, depth_colormap))
+
+def draw_collection_view(color_image, birdies):
+    return draw_birdies(color_image.copy(), birdies)
+
+def draw_mask(mask):
+    return mask
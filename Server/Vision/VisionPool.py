@@ -0,0 +1,190 @@
+import time
+import queue
+import multiprocessing as mp
+import numpy as np
+import cv2
+
+from Server.Vision.Aruco import make_aruco_detector, detect_markers
+from Server.Vision.BackgroundModel import BackgroundModel
+from Server.Vision.BlobDetector import make_blob_detector
+from Server.Vision.SharedFrameRing import SharedFrameRing
+
+"""
+This class runs the image work of the RealsenseServer in worker processes, so it is not bound to
+the one core of the control loop.
+
+The capture thread publishes every frameset into a SharedFrameRing. Jobs name a task and the seq
+of the frame to work on, the workers read the frame as zero-copy views and send back compact
+result records (marker corners, blob contours with rect, center and depth), never images.
+
+Worker 0 owns the background models (hit and collection), so every birdie job and every model
+change goes through it in order. The ArUco search holds no state and is spread round robin over
+the other workers (or done by worker 0 as well if it is the only one), so consecutive frames are
+searched in parallel.
+
+Results are kept per task and only the newest one is handed out: a slow consumer never works on
+a backlog of old frames.
+"""
+class VisionPool:
+    # Tasks with results that are consumed by the RealsenseServer
+    ARUCO = "aruco"
+    HIT = "hit"
+    COLLECTION = "collection"
+
+    def __init__(self, max_pixels, slots, workers, config):
+        self.ring = SharedFrameRing(max_pixels, slots)
+        self.workers = max(workers, 1)
+        self.max_in_flight = {self.ARUCO: max(self.workers - 1, 1), self.HIT: 1, self.COLLECTION: 1}
+
+        # Spawned workers do not inherit the camera pipeline, the threads or the GUI state of this process
+        context = mp.get_context("spawn")
+        self.results = context.Queue()
+        self.tasks = [context.Queue() for _ in range(self.workers)]
+        self.processes = [context.Process(target=vision_worker, args=(self.ring.spec(), tasks, self.results, config), daemon=True)
+                          for tasks in self.tasks]
+        for process in self.processes:
+            process.start()
+
+        self.next_aruco_worker = 0
+        self.in_flight = {} # task -> number of submitted jobs without result
+        self.submitted = {} # task -> seq of the newest submitted job
+        self.finished = {} # task -> (seq, payload) of the newest finished job that was not taken yet
+
+    # This function copies a frame into the ring (called by the capture thread)
+    def publish(self, frame):
+        self.ring.write(frame.seq, frame.timestamp, np.asanyarray(frame.depth_frame.get_data()), frame.color_image)
+
+    # This function hands a job for the frame seq to its worker
+    def submit(self, task, seq, **params):
+        if task == self.ARUCO and self.workers > 1:
+            worker = 1 + self.next_aruco_worker
+            self.next_aruco_worker = (self.next_aruco_worker + 1) % (self.workers - 1)
+        else:
+            worker = 0
+        self.tasks[worker].put((task, seq, params))
+        self.in_flight[task] = self.in_flight.get(task, 0) + 1
+        self.submitted[task] = max(seq, self.submitted.get(task, 0))
+
+    def busy(self, task):
+        return self.in_flight.get(task, 0) >= self.max_in_flight.get(task, 1)
+
+    def submitted_seq(self, task):
+        return self.submitted.get(task, 0)
+
+    def has_result(self, task):
+        self.poll()
+        return task in self.finished
+
+    # This function stores all results that arrived, keeping the newest per task
+    def poll(self, timeout=None):
+        try:
+            while True:
+                task, seq, payload = self.results.get(timeout=timeout) if timeout is not None else self.results.get_nowait()
+                timeout = None
+                self.in_flight[task] -= 1
+                if task not in self.finished or self.finished[task][0] < seq:
+                    self.finished[task] = (seq, payload)
+        except queue.Empty:
+            pass
+
+    # This function returns the (seq, payload) of the newest finished job of a task and removes it, or None.
+    # The payload is None if the frame was overwritten before the worker was done with it.
+    # With wait it blocks until a job in flight is done.
+    def take(self, task, wait=False, timeout=1.0):
+        self.poll()
+        deadline = time.time() + timeout
+        while wait and task not in self.finished and self.in_flight.get(task, 0) > 0:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise RuntimeError(f"VisionPool: no {task} result within {timeout} s")
+            self.poll(remaining)
+        return self.finished.pop(task, None)
+
+    # This function returns the current collection background image of worker 0
+    def collection_background_image(self):
+        self.submit("background_image", 0)
+        return self.take("background_image", wait=True)[1]
+
+    def stop(self):
+        for tasks in self.tasks:
+            tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+        self.ring.close()
+
+
+# This function is the main loop of a worker process.
+# Jobs are (task, seq, params), every job is answered with (task, seq, payload).
+def vision_worker(ring_spec, tasks, results, config):
+    ring = SharedFrameRing.attach(ring_spec)
+    aruco_detector = make_aruco_detector()
+    blob_detector = make_blob_detector(config, config["downscale"])
+    models = {} # background models of worker 0 (VisionPool.HIT, VisionPool.COLLECTION)
+
+    def make_model(gray_image, threshold):
+        return BackgroundModel(gray_image, threshold, config["downscale"], config["learning_rate"])
+
+    def find_blobs(model, gray_image, depth_image, seq, offset, exclude_polygons, learn_exclude_rects, learn_exclude_polygons, visualize):
+        contours, mask = blob_detector.detect(model, gray_image, offset=offset, exclude_polygons=exclude_polygons)
+        contours, rects, centers, depths = blob_detector.measure(contours, depth_image, config["depth_radius"], config["depth_scale"])
+        if not ring.holds(seq):
+            # The slot was written while it was read: do not learn a torn frame
+            model.last_small = None
+            return None
+
+        # Learn the background everywhere except at the foreground, the found blobs and the objects named by the server
+        exclude_rects = [(x - offset[0], y - offset[1], w, h) for x, y, w, h in rects.tolist()] + learn_exclude_rects
+        model.update(exclude_rects=exclude_rects, exclude_polygons=learn_exclude_polygons)
+        return contours, rects, centers, depths, (mask if visualize else None)
+
+    while True:
+        job = tasks.get()
+        if job is None:
+            break
+        task, seq, params = job
+
+        if task == "background_image":
+            results.put((task, seq, models[VisionPool.COLLECTION].image()))
+            continue
+        if task == "blob_config":
+            # The stream resolution changed, the pixel sizes of the blob detection with it
+            config.update(params)
+            blob_detector = make_blob_detector(config, config["downscale"])
+            results.put((task, seq, True))
+            continue
+        if task == "collection_background":
+            models[VisionPool.COLLECTION] = make_model(params["image"], params["threshold"])
+            results.put((task, seq, True))
+            continue
+
+        frame = ring.read(seq)
+        if frame is None:
+            results.put((task, seq, None))
+            continue
+        depth_image, color_image = frame
+
+        payload = None
+        if task == VisionPool.ARUCO:
+            aruco_corners, aruco_ids = detect_markers(aruco_detector, color_image, params["window"])
+            payload = (aruco_corners, aruco_ids, params["window"])
+        elif task == "hit_background":
+            x0, y0, x1, y1 = params["roi"]
+            models[VisionPool.HIT] = make_model(cv2.cvtColor(color_image[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY), params["threshold"])
+            payload = True
+        elif task == VisionPool.HIT:
+            x0, y0, x1, y1 = params["roi"]
+            gray_frame = cv2.cvtColor(color_image[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+            payload = find_blobs(models[VisionPool.HIT], gray_frame, depth_image, seq, (x0, y0), (),
+                                 params["tracked_rects"], (), params["visualize"])
+        elif task == VisionPool.COLLECTION:
+            gray_frame = cv2.cvtColor(color_image, cv2.COLOR_BGR2GRAY)
+            payload = find_blobs(models[VisionPool.COLLECTION], gray_frame, depth_image, seq, (0, 0),
+                                 params["exclude_polygons"], [], params["robot_polygons"], params["visualize"])
+
+        if not ring.holds(seq):
+            payload = None
+        results.put((task, seq, payload))
+
+    ring.close()
@@ -6,6 +6,7 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(project_root)
 
 import time
+import argparse
 from collections import deque
 import Server.Vision.RealsenseServer as RealsenseServer
 import Server.Location as Location
@@ -17,7 +18,7 @@ from queue import Queue
 from threading import Event, Thread
 from enum import Enum, auto
 import Server.RobotCommander as RobotCommander
-import Server.Path as Path
+import Server.RoutePlanner as RoutePlanner
 from Server.Lesson import make_lesson
 import Server.Vision.Court as Court
 import Server.Chatbot as Chatbot
@@ -42,7 +43,6 @@ class Stage(Enum):
 
     ROUND_END = auto()
 
-    COLLECT_EVACUATE = auto()
     COLLECT_PLAN = auto()
     COLLECT_ACT = auto()
 
@@ -61,6 +61,7 @@ class DriveState:
         if angle is None:
             angle = robot_location.angle_to(target)
         self.angle = angle
+        self.turn_seq = None # frame the turn was last sent on
 
 def has_collected(robot_location, birdie_position):
     return robot_location.flat_distance(birdie_position) < robot_location.flat_distance(robot_location.get_grabber_position())
@@ -71,17 +72,23 @@ def same_sign(a, b):
 def check_same_sign(a, b):
     return abs(a - b) > math.radians(3)
 
-def check_driving(drive_state: DriveState, robot_location: Location.RobotLocation, robot_commander):
+# frame_seq is the frame the robot location was last observed on
+def check_driving(drive_state: DriveState, robot_location: Location.RobotLocation, robot_commander, frame_seq=None):
     if not drive_state is None:
         match drive_state.stage:
             case DriveStage.START:
                 robot_commander.send_command(RobotCommander.Turn(drive_state.angle))
+                drive_state.turn_seq = frame_seq
                 drive_state.stage = DriveStage.WAIT_ANGLE
 
             case DriveStage.WAIT_ANGLE:
                 angle_diff = robot_location.angle_to(drive_state.target)
                 if angle_diff == drive_state.angle:
-                    robot_commander.send_command(RobotCommander.Turn(drive_state.angle))
+                    # The robot has not started turning: send the turn again, but only once per frame
+                    # (with threaded capture several ticks see the same frame)
+                    if frame_seq is None or frame_seq != drive_state.turn_seq:
+                        robot_commander.send_command(RobotCommander.Turn(drive_state.angle))
+                        drive_state.turn_seq = frame_seq
                 elif abs(angle_diff) < math.radians(4):
                     robot_commander.send_command(RobotCommander.Forward())
                     drive_state.stage = DriveStage.WAIT_DIST
@@ -99,8 +106,21 @@ def check_driving(drive_state: DriveState, robot_location: Location.RobotLocatio
 
     return drive_state
 
-def main():
-    realsense = RealsenseServer.RealsenseServer(robotArucoId=42, courtArucoId=181, minAreaThreshold=700, maxAreaThreshold=8000)
+def report_latency(latencies):
+    latencies_ms = np.array(latencies) * 1000
+    print(f"LATENCY: {len(latencies_ms)} frames, mean {latencies_ms.mean():.1f} ms, p95 {np.percentile(latencies_ms, 95):.1f} ms, max {latencies_ms.max():.1f} ms")
+
+def main(record_path=None, playback_path=None, playback_realtime=True, measure_latency=False, headless=False, vision_workers=0):
+    # A max speed replay has to process every recorded frame, so it does not use the acquisition thread
+    realsense = RealsenseServer.RealsenseServer(robotArucoId=42, courtArucoId=181, minAreaThreshold=700, maxAreaThreshold=8000,
+                                                threaded_capture=playback_path is None or playback_realtime,
+                                                record_path=record_path, playback_path=playback_path, playback_realtime=playback_realtime,
+                                                headless=headless, vision_workers=vision_workers)
+    latencies = deque(maxlen=300)
+    latency_seq = 0 # frame the last latency was measured on, with threaded capture several ticks work on the same frame
+    # With the acquisition thread the loop does not wait for the camera, so it runs the controller at a fixed rate
+    CONTROL_PERIOD = 1 / 60
+    next_tick = time.time()
 
     robot_commander = None
 
@@ -109,7 +129,9 @@ def main():
     drive_state = None
     detectedHitBirdieCount = 0
     BIRDIES_PER_ROUND = 4
+    landed_birdies = deque()
     collectionBirdies = []
+    route_planner = RoutePlanner.RoutePlanner()
     event_queue = Queue()
     point_queue = Queue()
     explain_stage = None
@@ -121,12 +143,25 @@ def main():
     side = None
     while True:
         # Here perform actions that should be executed all the time
-        realsense.detect_arucos()
+        # detect_arucos picks up the newest frame of this tick, all other detections reuse it
+        try:
+            realsense.detect_arucos()
+        except RuntimeError:
+            if realsense.is_playback:
+                print("Playback finished.")
+                if len(latencies) > 0:
+                    report_latency(latencies)
+                quit()
+            raise
+
+        # Filtered robot pose, predicted up to now
+        realsense.update_robot_pose()
 
         drive_state = check_driving(
             drive_state=drive_state,
             robot_location=realsense.robot,
             robot_commander=robot_commander,
+            frame_seq=realsense.last_aruco_seq,
             )
 
         # Here perform actions that should be executed depending on the stage
@@ -146,6 +181,7 @@ def main():
 
                     input("STARTUP_ROBOT: Press to continue.")
                     robot_commander = RobotCommander.RobotCommander()
+                    robot_commander.add_listener(realsense.pose_filter.apply_command)
                     print("STARTUP_ROBOT: Confirmed.")
                     robot_commander.send_command(RobotCommander.ResetGrabberAngle())
                     setup_done = True
@@ -183,6 +219,8 @@ def main():
                         explain_stage = None
 
             case Stage.START_ROUND:
+                # Birdies in flight are tracked in a high frame rate mode
+                realsense.select_profile("hit")
                 detectedHitBirdieCount = 0
                 stage = Stage.HIT_INSTRUCT
                 if round_num % 2 == 0:
@@ -210,78 +248,81 @@ def main():
                 # b. Camera is live, tracking position of court
                 realsense.detect_birdies(visualize = True)
 
-                #print("birdies landed:", realsense.get_num_birdies_landed(), num_birdies_landed)
-                if realsense.tracked_hitbirdie is not None and realsense.tracked_hitbirdie.hit_ground:
+                landed_birdies.extend(realsense.birdie_tracker.new_landings())
+                if len(landed_birdies) > 0:
                     print("HIT_AWAITPLAYER: Birdie detected. Reacting.")
-
-                    detectedHitBirdieCount += 1
                     stage = Stage.HIT_REACT
 
             case Stage.HIT_REACT:
-                birdie = realsense.tracked_hitbirdie
-                dist = birdie.impact_position.flat_distance(realsense.robot)
-                isInside = realsense.court.is_inside(birdie, side)
-                if isInside:
-                    score = score + 2 - (np.clip(dist, 100, 400) - 100) / 300 * 2
-                else:
-                    robot_commander.send_command(RobotCommander.Fail())
+                # React to every birdie that landed (several can land at once in rapid fire drills)
+                # impact_position is the predicted impact if the landing was reported while the birdie was still in the air
+                impacts = [(birdie.impact_position.x, birdie.impact_position.y) for birdie in landed_birdies]
+                insides = realsense.court.inside(impacts, side)
+                for birdie, isInside in zip(landed_birdies, insides.tolist()):
+                    detectedHitBirdieCount += 1
+                    dist = birdie.impact_position.flat_distance(realsense.robot)
+                    if isInside:
+                        # full points within 100 mm of the robot, none beyond 400 mm
+                        score = score + 2 - (np.clip(dist, 100, 400) - 100) / 300 * 2
+                    else:
+                        robot_commander.send_command(RobotCommander.Fail())
 
-                print(f"HIT_REACT: Birdie(D: {dist}, IN: {isInside})")
+                    print(f"HIT_REACT: Birdie {birdie.id}(D: {dist}, IN: {isInside})")
+                landed_birdies.clear()
 
                 stage = Stage.HIT_AWAITSTATIC
 
             case Stage.HIT_AWAITSTATIC:
                 realsense.detect_birdies(visualize = True)
+                # Birdies still in the air can land while the others settle
+                landed_birdies.extend(realsense.birdie_tracker.new_landings())
+                if len(landed_birdies) > 0:
+                    stage = Stage.HIT_REACT
                 # b. Return to HIT_INSTRUCT
-                if realsense.contours_are_static():
-                    if detectedHitBirdieCount == BIRDIES_PER_ROUND:
+                elif realsense.contours_are_static():
+                    if detectedHitBirdieCount >= BIRDIES_PER_ROUND:
                         stage = Stage.ROUND_END
                     else:
                         stage = Stage.HIT_INSTRUCT
 
             case Stage.ROUND_END:
-                stage = Stage.COLLECT_EVACUATE
+                print(f"ROUND_END: camera delivered {realsense.delivered_fps():.1f} fps while hitting.")
+                realsense.select_profile("collection")
+                stage = Stage.COLLECT_PLAN
                 drive_state = None
 
-            case Stage.COLLECT_EVACUATE:
-                # Robot drives off court in a controlled way (we need to get it back on the court again)
-                if drive_state is None:
-                    drive_state = DriveState(target=Location.Position(150, 150, 0), robot_location=realsense.robot)
-                if drive_state.stage == DriveStage.DONE:
-                    robot_commander.send_command(RobotCommander.WheelTurn(500))
-                    drive_state = None
-                    stage = Stage.COLLECT_PLAN
-
             case Stage.COLLECT_PLAN:
-                time.sleep(5.5)
-
-                # a. Take image
+                # a. Take image (the robot stays on court, its footprint is masked out of the detection)
                 print("COLLECT_PLAN: Taking collect birdie image.")
                 collectionBirdies = realsense.detect_collection_birdies(visualize=True)
                 if len(collectionBirdies) > 0:
-                    visionBorder = (150, 150, 1280 - 150, 720 - 150)
-                    path = Path.make_path(realsense.robot, collectionBirdies, visionBorder)
+                    visionBorder = realsense.vision_border(150)
+                    route = RoutePlanner.Route(route_planner, realsense.robot, collectionBirdies, visionBorder)
                     stage = Stage.COLLECT_ACT
                 else:
                     stage = Stage.START_ROUND
 
-                # b. Make fixed path all the way from first to last one detected
-                # c. Return robot to court
-                robot_commander.send_command(RobotCommander.WheelTurn(-600))
-                time.sleep(7)
-
             case Stage.COLLECT_ACT:
+                # Repair the route with the birdies of a new frame (collected, nudged or newly seen birdies),
+                # the ticks between two frames do not wait for the camera
+                detectedBirdies = realsense.detect_collection_birdies(visualize=True, wait=False)
+                if detectedBirdies is not None and route.repair(realsense.robot, detectedBirdies, realsense.occluded_by_robot):
+                    drive_state = None # the birdie the robot drives to moved or is gone
+
                 # Get birdie
                 if drive_state is None or drive_state.stage == DriveStage.DONE:
-                    if len(path) > 0:
-                        drive_target, turn_direction = path.popleft()
+                    if len(route) > 0:
+                        drive_target, turn_direction = route.next_target()
                         drive_state = DriveState(target=drive_target, robot_location=realsense.robot, angle=turn_direction)
                     else:
-                        stage = Stage.COLLECT_EVACUATE
+                        # Look again for birdies that were not seen or pushed away
+                        robot_commander.send_command(RobotCommander.Stop())
+                        stage = Stage.COLLECT_PLAN
                         drive_state = None
 
             case Stage.END:
                 robot_commander.send_command(RobotCommander.End())
+                realsense.stop()
                 quit()
 
         if setup_done and not event_queue.empty():
@@ -300,7 +341,32 @@ def main():
                 case Chatbot.EventType.END:
                     stage = Stage.END
 
+        if measure_latency and realsense.frame is not None and realsense.frame.seq != latency_seq:
+            # Time from capturing the frame until the first tick working on it is done
+            latency_seq = realsense.frame.seq
+            latencies.append(time.time() - realsense.frame.timestamp)
+            if len(latencies) == latencies.maxlen:
+                report_latency(latencies)
+                latencies.clear()
+
+        if realsense.frame_grabber is not None:
+            # At least one tick per frame of the current sensor profile, so no frame waits for the next tick
+            next_tick += min(CONTROL_PERIOD, 1 / realsense.stream_mode[2])
+            remaining = next_tick - time.time()
+            if remaining > 0:
+                time.sleep(remaining)
+            else:
+                next_tick = time.time()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--record", help="record the camera streams into this .bag file")
+    parser.add_argument("--playback", help="replay this .bag file instead of using the camera")
+    parser.add_argument("--max-speed", action="store_true", help="replay as fast as possible instead of in recorded time")
+    parser.add_argument("--latency", action="store_true", help="print per frame latency statistics")
+    parser.add_argument("--headless", action="store_true", help="run without any visualization windows")
+    parser.add_argument("--vision-workers", type=int, default=0, help="run the image work in this many worker processes (0: in the control loop)")
+    args = parser.parse_args()
+    main(record_path=args.record, playback_path=args.playback, playback_realtime=not args.max_speed, measure_latency=args.latency,
+         headless=args.headless, vision_workers=args.vision_workers)
\ No newline at end of file
@@ -223,7 +223,7 @@ def main():
             case Stage.COLLECT_EVACUATE:
                 # Robot drives off court in a controlled way (we need to get it back on the court again)
                 if drive_state is None:
-                    drive_state = DriveState(target=Location.Position(150, 150, 0), robot_location=realsense.robot)
+                    drive_state = DriveState(target=realsense.pixel_to_court(150, 150), robot_location=realsense.robot)
                 if drive_state.stage == DriveStage.DONE:
                     robot_commander.send_command(RobotCommander.WheelTurn(500))
                     drive_state = None
@@ -236,7 +236,7 @@ def main():
                 print("COLLECT_PLAN: Taking collect birdie image.")
                 collectionBirdies = realsense.detect_collection_birdies(visualize=True)
                 if len(collectionBirdies) > 0:
-                    visionBorder = (150, 150, 1280 - 150, 720 - 150)
+                    visionBorder = realsense.vision_border(150)
                     path = Path.make_path(realsense.robot, collectionBirdies, visionBorder)
                     stage = Stage.COLLECT_ACT
                 else: